@@ -1,53 +1,114 @@
 from django.contrib import admin
-from .models import User, BankAccount, VerificationToken, Message, CardRequest, Transaction, PaymentDetails
+from .models import User, BankAccount, VerificationToken, Message, CardRequest, Transaction, PaymentDetails, AuditLog
 from django.utils.safestring import mark_safe
-from django.urls import reverse
+from django.urls import path, reverse
 from django.shortcuts import redirect
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.template.loader import render_to_string
+from django.template.response import TemplateResponse
+from .inbox import inbox_page
+from .pagination import EstimatedCountPaginator
 from django import forms
+from django.db import transaction
+from .snapshots import invalidate_dashboard
+from .lookup import forget_recipients
 
 
 
 
 
-@admin.register(User)
-class UserAdmin(admin.ModelAdmin):
-    list_display = ('username', 'email', 'is_active', 'email_verified', 'date_of_birth', 'phone_number')
-    list_filter = ('is_active', 'email_verified', 'gender', 'date_of_birth', 'country')
-    search_fields = ('username', 'email', 'phone_number', 'social_security_number')
-    actions = ['freeze_bank_accounts', 'unfreeze_bank_accounts']
+def bulk_update(request, queryset, action, **changes):
+    """
+    Apply changes to every row of queryset (a model with a user foreign key)
+    with one UPDATE and record one AuditLog entry listing the affected ids.
+    The rows are locked first so the ids logged are exactly the rows updated.
+    Returns the number of rows updated.
+    """
+    with transaction.atomic():
+        rows = list(queryset.select_for_update().order_by('pk').values_list('pk', 'user_id'))
+        if not rows:
+            return 0
+        updated = queryset.update(**changes)
+        AuditLog.objects.create(
+            actor=request.user,
+            action=action,
+            model=queryset.model._meta.label,
+            object_ids=[pk for pk, _ in rows],
+            count=updated,
+        )
+        invalidate_dashboard(*(user_id for _, user_id in rows))
+    return updated
+
+
+# action name -> (statuses it applies to, new status, past tense for the admin message)
+ACCOUNT_STATUS_ACTIONS = {
+    'freeze': (['Active'], 'Frozen', 'frozen'),
+    'unfreeze': (['Frozen'], 'Active', 'unfrozen'),
+    'close': (['Active', 'Frozen'], 'Closed', 'closed'),
+    'reactivate': (['Closed'], 'Active', 'reactivated'),
+}
+
+
+class AccountStatusActionsMixin:
+    """
+    Freeze / unfreeze / close / reactivate as set-based actions. The admin
+    defines accounts_for(), mapping the changelist selection to a BankAccount
+    queryset without loading it.
+    """
+
+    def set_account_status(self, request, queryset, action):
+        from_statuses, status, done = ACCOUNT_STATUS_ACTIONS[action]
+        accounts = self.accounts_for(queryset).filter(status__in=from_statuses)
+        numbers = list(accounts.values_list('account_number', flat=True))
+        count = bulk_update(request, accounts, f"{action}_accounts", status=status)
+        forget_recipients(*numbers)
+        self.message_user(request, f"{count} bank accounts have been {done}.")
 
+    @admin.action(description="Freeze selected bank accounts")
     def freeze_bank_accounts(self, request, queryset):
-        count = 0
-        for user in queryset:
-            try:
-                account = BankAccount.objects.get(user=user)
-                account.is_frozen = True
-                account.save()
-                count += 1
-            except BankAccount.DoesNotExist:
-                pass
-        self.message_user(request, f"{count} bank accounts have been frozen.")
-    freeze_bank_accounts.short_description = "Freeze selected users' bank accounts"
+        self.set_account_status(request, queryset, 'freeze')
 
+    @admin.action(description="Unfreeze selected bank accounts")
     def unfreeze_bank_accounts(self, request, queryset):
-        count = 0
-        for user in queryset:
-            try:
-                account = BankAccount.objects.get(user=user)
-                account.is_frozen = False
-                account.save()
-                count += 1
-            except BankAccount.DoesNotExist:
-                pass
-        self.message_user(request, f"{count} bank accounts have been unfrozen.")
-    unfreeze_bank_accounts.short_description = "Unfreeze selected users' bank accounts"
+        self.set_account_status(request, queryset, 'unfreeze')
+
+    @admin.action(description="Close selected bank accounts")
+    def close_bank_accounts(self, request, queryset):
+        self.set_account_status(request, queryset, 'close')
+
+    @admin.action(description="Reactivate selected closed bank accounts")
+    def reactivate_bank_accounts(self, request, queryset):
+        self.set_account_status(request, queryset, 'reactivate')
+
+
+ACCOUNT_ACTIONS = ['freeze_bank_accounts', 'unfreeze_bank_accounts', 'close_bank_accounts', 'reactivate_bank_accounts']
+
+
+@admin.register(User)
+class UserAdmin(AccountStatusActionsMixin, admin.ModelAdmin):
+    list_display = ('username', 'email', 'is_active', 'email_verified', 'date_of_birth', 'phone_number')
+    list_filter = ('is_active', 'email_verified', 'gender', 'date_of_birth', 'country')
+    search_fields = ('username', 'email', 'phone_number')
+    actions = ACCOUNT_ACTIONS
+    show_full_result_count = False
+
+    def accounts_for(self, queryset):
+        return BankAccount.objects.filter(user__in=queryset.values('pk'))
 
 
 @admin.register(BankAccount)
-class BankAccountAdmin(admin.ModelAdmin):
-    list_display = ('user', 'account_number', 'account_type', 'balance', 'created_at')
-    list_filter = ('account_type', 'created_at')
+class BankAccountAdmin(AccountStatusActionsMixin, admin.ModelAdmin):
+    list_display = ('user', 'account_number', 'account_type', 'balance', 'status', 'created_at')
+    list_filter = ('account_type', 'status', 'created_at')
     search_fields = ('account_number', 'user__username', 'user__email')
+    actions = ACCOUNT_ACTIONS
+    list_select_related = ('user',)
+    autocomplete_fields = ('user',)
+    show_full_result_count = False
+
+    def accounts_for(self, queryset):
+        return queryset
 
 
 @admin.register(VerificationToken)
@@ -55,12 +116,35 @@ class VerificationTokenAdmin(admin.ModelAdmin):
     list_display = ('user', 'token', 'created_at')
     list_filter = ('created_at',)
     search_fields = ('user__username', 'user__email', 'token')
+    list_select_related = ('user',)
+    autocomplete_fields = ('user',)
+
+
+# Messages shown per step of the admin conversation.
+CONVERSATION_WINDOW = 50
+
+
+def conversation_window(user_id, before=None):
+    """
+    Up to CONVERSATION_WINDOW of a user's messages (before the given id, if
+    any), oldest first, plus whether earlier ones exist. One indexed query.
+    """
+    msgs = Message.objects.filter(user_id=user_id).only("id", "sender", "content", "photo", "photo_thumbnails", "created_at")
+    if before is not None:
+        msgs = msgs.filter(id__lt=before)
+    window = list(msgs.order_by("-id")[:CONVERSATION_WINDOW + 1])
+    return window[:CONVERSATION_WINDOW][::-1], len(window) > CONVERSATION_WINDOW
 
 
 class MessageAdmin(admin.ModelAdmin):
     list_display = ("user", "sender", "short_content", "created_at")
     list_filter = ("sender", "created_at")
     search_fields = ("user__username", "content")
+    list_select_related = ("user",)
+    autocomplete_fields = ("user",)
+    date_hierarchy = "created_at"
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     readonly_fields = ("user", "sender", "created_at", "conversation", "reply_section")
 
     def short_content(self, obj):
@@ -68,72 +152,60 @@ class MessageAdmin(admin.ModelAdmin):
     short_content.short_description = "Message Preview"
 
     def conversation(self, obj):
-        """Render WhatsApp-like conversation."""
-        msgs = Message.objects.filter(user=obj.user).order_by("created_at")
-        chat_html = """
-        <style>
-            .chat-box {
-                max-height: 450px;
-                overflow-y: auto;
-                border: 1px solid #ccc;
-                padding: 10px;
-                border-radius: 8px;
-                background: #f9f9f9;
-                scroll-behavior: smooth;
-            }
-            .msg {
-                clear: both;
-                padding: 8px 12px;
-                margin: 6px 0;
-                border-radius: 15px;
-                display: inline-block;
-                max-width: 70%;
-                word-wrap: break-word;
-            }
-            .admin-msg {
-                background: #dcf8c6;
-                float: right;
-                text-align: right;
-            }
-            .user-msg {
-                background: #e4e6eb;
-                float: left;
-                text-align: left;
-            }
-            .msg-time {
-                font-size: 11px;
-                color: #777;
-                display: block;
-                margin-top: 4px;
-            }
-        </style>
-        <div class="chat-box" id="chatBox">
-        """
-
-        for msg in msgs:
-            photo_html = ""
-            if msg.photo:
-                photo_html = f'<br><a href="{msg.photo.url}" target="_blank"><img src="{msg.photo.url}" style="max-width:200px;max-height:180px;border-radius:8px;margin-top:6px;border:1px solid #ccc;"></a>'
-            chat_html += f"""
-                <div class="msg {'admin-msg' if msg.sender == 'Admin' else 'user-msg'}">
-                    <strong>{'Admin' if msg.sender == 'Admin' else msg.user.username}:</strong>
-                    <br>{msg.content}{photo_html}
-                    <span class="msg-time">{msg.created_at.strftime('%b %d, %Y %H:%M')}</span>
-                </div>
-            """
-
-        chat_html += "</div>"
-        chat_html += """
-        <script>
-            document.addEventListener("DOMContentLoaded", function() {
-                var chatBox = document.getElementById("chatBox");
-                chatBox.scrollTop = chatBox.scrollHeight;
-            });
-        </script>
-        """
-        return mark_safe(chat_html)
+        """Render WhatsApp-like conversation: the latest CONVERSATION_WINDOW messages, earlier ones on demand."""
+        msgs, has_earlier = conversation_window(obj.user_id)
+        return render_to_string("admin/accounts/message/conversation.html", {
+            "messages": msgs,
+            "customer": obj.user,
+            "has_earlier": has_earlier,
+            "earlier_url": reverse("admin:accounts_message_conversation", args=[obj.pk]),
+        })
     conversation.short_description = "Conversation"
 
+    def get_urls(self):
+        urls = [
+            path("inbox/", self.admin_site.admin_view(self.inbox_view), name="accounts_message_inbox"),
+            path(
+                "<path:object_id>/conversation/",
+                self.admin_site.admin_view(self.conversation_view),
+                name="accounts_message_conversation",
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def inbox_view(self, request):
+        """Support inbox: one row per user thread, newest activity first (?waiting=1 for unanswered only)."""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        cursor = request.GET.get("before")
+        waiting = request.GET.get("waiting") == "1"
+        threads, next_cursor = inbox_page(cursor, waiting_only=waiting)
+        return TemplateResponse(request, "admin/accounts/message/inbox.html", {
+            **self.admin_site.each_context(request),
+            "title": "Support inbox",
+            "opts": self.model._meta,
+            "threads": threads,
+            "waiting": waiting,
+            "next_cursor": next_cursor,
+            "is_first_page": not cursor,
+        })
+
+    def conversation_view(self, request, object_id):
+        """'Load earlier' fragment: messages before ?before=<message id>."""
+        obj = self.get_object(request, object_id)
+        if obj is None or not self.has_view_permission(request, obj):
+            raise PermissionDenied
+        before = request.GET.get("before", "")
+        if not before.isdigit():
+            return HttpResponseBadRequest("before must be a message id.")
+        msgs, has_earlier = conversation_window(obj.user_id, before=int(before))
+        response = HttpResponse(render_to_string("admin/accounts/message/_conversation_messages.html", {
+            "messages": msgs,
+            "customer": obj.user,
+        }))
+        response["X-Has-Earlier"] = "1" if has_earlier else "0"
+        return response
+
     def reply_section(self, obj):
         """Admin reply box."""
         return mark_safe(f"""
@@ -176,6 +248,30 @@ class CardRequestAdmin(admin.ModelAdmin):
     list_display = ('user', 'status', 'date_requested')  # Use 'date_requested' instead of 'created_at'
     search_fields = ('user__username',)
     list_filter = ('status',)
+    actions = ['approve_card_requests']
+    list_select_related = ('user',)
+    autocomplete_fields = ('user',)
+    show_full_result_count = False
+
+    @admin.action(description="Approve selected pending card requests")
+    def approve_card_requests(self, request, queryset):
+        # The dashboard has always created requests as 'pending', the admin form as 'Pending'.
+        count = bulk_update(request, queryset.filter(status__iexact='pending'), 'approve_card_requests', status='Approved')
+        self.message_user(request, f"{count} card requests have been approved.")
+
+
+@admin.register(AuditLog)
+class AuditLogAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'actor', 'action', 'model', 'count')
+    list_filter = ('action', 'model')
+    list_select_related = ('actor',)
+    readonly_fields = ('created_at', 'actor', 'action', 'model', 'count', 'object_ids')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
 
 
 @admin.register(Transaction)
@@ -183,6 +279,11 @@ class TransactionAdmin(admin.ModelAdmin):
     list_display = ('account', 'date', 'description', 'amount', 'type')
     search_fields = ('account__account_number', 'description')
     list_filter = ('type', 'date')
+    list_select_related = ('account__user',)
+    autocomplete_fields = ('account',)
+    date_hierarchy = 'date'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 @admin.register(PaymentDetails)
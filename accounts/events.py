@@ -0,0 +1,169 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+
+from .models import Message
+from .thumbnails import srcset, thumbnail_url
+from .unread import unread_count
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds between keep-alive comments on an idle stream. Each one also runs a
+# catch-up query, which picks up messages saved by other processes.
+HEARTBEAT_SECONDS = 25
+# How long EventSource waits before reconnecting after a dropped stream.
+RETRY_MS = 5000
+# Events buffered per connection before the client is told to resync.
+QUEUE_SIZE = 100
+
+
+def message_payload(msg):
+    return {
+        'id': msg.id,
+        'sender': msg.sender,
+        'content': msg.content,
+        'photo': msg.photo.url if msg.photo else None,
+        'photo_thumb': thumbnail_url(msg.photo, msg.photo_thumbnails, 320) if msg.photo else None,
+        'photo_srcset': {fmt: srcset(msg.photo, msg.photo_thumbnails, fmt) for fmt in ('webp', 'jpeg')},
+        'created_at': msg.created_at.isoformat(),
+    }
+
+
+class Broker:
+    """
+    In-process pub/sub keyed by user id. Subscribers are asyncio queues owned
+    by SSE streams; publish() is thread safe, so sync views, admin actions and
+    signal handlers can call it directly.
+    Only streams served by the same process are reached; the heartbeat
+    catch-up in stream() covers everything else.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(dict)  # user_id -> {queue: loop}
+
+    def subscribe(self, user_id):
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        with self._lock:
+            self._subscribers[user_id][queue] = asyncio.get_running_loop()
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        with self._lock:
+            queues = self._subscribers.get(user_id, {})
+            queues.pop(queue, None)
+            if not queues:
+                self._subscribers.pop(user_id, None)
+
+    def has_subscribers(self, user_id):
+        return user_id in self._subscribers
+
+    def publish(self, user_id, event):
+        with self._lock:
+            targets = list(self._subscribers.get(user_id, {}).items())
+        for queue, loop in targets:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, event)
+            except RuntimeError:
+                # The stream's event loop is gone; its finally block never ran.
+                self.unsubscribe(user_id, queue)
+
+
+def _offer(queue, event):
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        # Slow consumer: drop the backlog and make the client resync instead.
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait({'type': 'resync'})
+
+
+broker = Broker()
+
+
+def publish_message(msg):
+    broker.publish(msg.user_id, {'type': 'message', 'message': message_payload(msg)})
+
+
+def publish_unread(user_id, count=None):
+    """Push the unread badge count; looks it up if not given (only when someone is listening)."""
+    if not broker.has_subscribers(user_id):
+        return
+    if count is None:
+        count = unread_count(user_id)
+    broker.publish(user_id, {'type': 'unread', 'count': count})
+
+
+def format_event(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+async def _unread_count(user_id):
+    return await sync_to_async(unread_count)(user_id)
+
+
+async def _missed(user_id, after):
+    return [
+        msg async for msg in Message.objects.filter(user_id=user_id, id__gt=after)
+        .order_by('id')
+        .only('id', 'sender', 'content', 'photo', 'photo_thumbnails', 'created_at')[:QUEUE_SIZE]
+    ]
+
+
+async def stream(user_id, after=0):
+    """
+    Server-Sent Events for one user's chat: 'message' events (with the message
+    id as the event id, so a reconnect resumes via Last-Event-ID), 'unread'
+    badge counts and 'resync' when the client should fall back to a delta sync.
+    after=0 means "only what happens from now on".
+    """
+    queue = broker.subscribe(user_id)
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        yield format_event('unread', {'count': await _unread_count(user_id)})
+
+        if after:
+            last_id = after
+        else:
+            latest = await Message.objects.filter(user_id=user_id).order_by('-id').values_list('id', flat=True).afirst()
+            last_id = latest or 0
+
+        pending = await _missed(user_id, last_id) if after else []
+        while True:
+            for msg in pending:
+                if msg.id > last_id:
+                    last_id = msg.id
+                    yield format_event('message', message_payload(msg), event_id=msg.id)
+            pending = []
+
+            try:
+                event = await asyncio.wait_for(queue.get(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                pending = await _missed(user_id, last_id)
+                if any(msg.sender == 'Admin' for msg in pending):
+                    yield format_event('unread', {'count': await _unread_count(user_id)})
+                continue
+
+            if event['type'] == 'message':
+                payload = event['message']
+                if payload['id'] > last_id:
+                    last_id = payload['id']
+                    yield format_event('message', payload, event_id=payload['id'])
+            elif event['type'] == 'unread':
+                yield format_event('unread', {'count': event['count']})
+            else:
+                yield format_event(event['type'], {})
+    finally:
+        broker.unsubscribe(user_id, queue)
@@ -0,0 +1,137 @@
+import uuid
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
+from django.utils.timezone import now
+
+from .models import IdempotencyKey
+
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+FORM_FIELD = 'idempotency_key'
+MAX_KEY_LENGTH = 255
+
+
+def get_ttl():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 60 * 60 * 24))
+
+
+def get_lease():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_CLAIM_LEASE', 60))
+
+
+def get_key(request):
+    """Idempotency-Key header wins over the hidden form field."""
+    key = request.META.get(HEADER) or request.POST.get(FORM_FIELD) or ''
+    return key.strip()[:MAX_KEY_LENGTH]
+
+
+def purge_expired():
+    """Delete expired keys. Returns the number of rows removed."""
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=now()).delete()
+    return deleted
+
+
+def _take_over(record):
+    """
+    Claim an unanswered key whose holder has not finished within the lease
+    (its worker most likely died). The conditional UPDATE lets only one of
+    several concurrent retries win.
+    """
+    claimed_at = now()
+    taken = IdempotencyKey.objects.filter(
+        pk=record.pk, status_code__isnull=True, claimed_at__lte=claimed_at - get_lease()
+    ).update(claimed_at=claimed_at)
+    if taken:
+        record.claimed_at = claimed_at
+    return bool(taken)
+
+
+def _claim(request, key, endpoint):
+    """
+    Insert the key before running the view. The unique (user, key) constraint
+    makes this the arbitration point between concurrent duplicates.
+    Returns (record, created).
+    """
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                user=request.user, key=key, endpoint=endpoint, expires_at=now() + get_ttl()
+            ), True
+    except IntegrityError:
+        record = IdempotencyKey.objects.get(user=request.user, key=key)
+        if record.is_expired():
+            record.delete()
+            return _claim(request, key, endpoint)
+        if record.status_code is None and record.endpoint == endpoint and _take_over(record):
+            return record, True
+        return record, False
+
+
+def _replay(request, record):
+    # Flash only for responses a browser shows; a replayed JSON answer would
+    # leave the message waiting on the user's next page.
+    if record.location or record.content_type.startswith('text/html'):
+        messages.info(request, "This request has already been processed.")
+    if record.location:
+        return HttpResponseRedirect(record.location)
+    return HttpResponse(record.body, status=record.status_code, content_type=record.content_type or None)
+
+
+def _store(record, response):
+    record.status_code = response.status_code
+    record.content_type = response.get('Content-Type', '')
+    record.location = response.get('Location', '')
+    if not record.location and not response.streaming:
+        record.body = response.content.decode(response.charset or 'utf-8', errors='replace')
+    record.save(update_fields=['status_code', 'content_type', 'location', 'body'])
+
+
+def idempotent(view_func):
+    """
+    Make a POST view safe to repeat. A request carrying a key that has already
+    been answered gets the stored response back without running the view, so
+    no BankAccount row is touched twice.
+
+    Every request gets a fresh request.idempotency_key for the rendered form
+    to echo back in a hidden field. POSTs without a key run as before.
+
+    Apply it outside @transaction.atomic: the claim must commit on its own so
+    a concurrent duplicate sees it. A claim left unanswered for longer than
+    IDEMPOTENCY_CLAIM_LEASE (a crashed worker) can be taken over by a retry.
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        key = get_key(request) if request.method == 'POST' else ''
+        # Key for the next submission, e.g. when a POST re-renders the form.
+        request.idempotency_key = uuid.uuid4().hex
+        if not key:
+            return view_func(request, *args, **kwargs)
+
+        endpoint = request.resolver_match.view_name if request.resolver_match else request.path
+        record, created = _claim(request, key, endpoint)
+        if not created:
+            if record.endpoint != endpoint:
+                return JsonResponse({'success': False, 'error': 'Idempotency key was used for a different request.'}, status=422)
+            if record.status_code is None:
+                return JsonResponse({'success': False, 'error': 'A request with this key is still being processed.'}, status=409)
+            return _replay(request, record)
+
+        try:
+            response = view_func(request, *args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+
+        if response.status_code >= 500:
+            # Let the client retry server errors with the same key.
+            record.delete()
+        else:
+            _store(record, response)
+        return response
+
+    return wrapper
@@ -0,0 +1,166 @@
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction
+
+from .forms import UserRegistrationForm
+from .models import BankAccount, User
+from .numbering import reserve_account_numbers
+from .utils import get_currency_from_country
+
+
+# Rows validated, hashed and inserted together.
+CHUNK_SIZE = 500
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+# Passwords sent to a pool worker per task. PBKDF2 dominates, so small is fine.
+HASH_BATCH = 8
+
+
+class ImportForm(UserRegistrationForm):
+    """
+    Registration rules without the per-row username/email queries;
+    import_chunk() checks uniqueness for a whole chunk at once.
+    """
+
+    def validate_unique(self):
+        pass
+
+
+def read_rows(f, fmt):
+    """Yield (line number, row dict, error) for each record of an open CSV/JSONL file."""
+    if fmt == 'csv':
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+    for line_no, line in enumerate(f, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_no, None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(row, dict):
+            yield line_no, None, "Expected a JSON object."
+            continue
+        yield line_no, row, None
+
+
+def _form_errors(form):
+    return '; '.join(
+        message if field == '__all__' else f"{field}: {message}"
+        for field, messages in form.errors.items()
+        for message in messages
+    )
+
+
+def validate_row(row):
+    """Return (unsaved User, raw password) or raise ValueError with the form's errors."""
+    data = {key: value for key, value in row.items() if value not in (None, '')}
+    data.setdefault('confirm_password', data.get('password'))
+    form = ImportForm(data=data)
+    if not form.is_valid():
+        raise ValueError(_form_errors(form))
+    user = form.save(commit=False)
+    user.is_active = True
+    return user, form.cleaned_data['password']
+
+
+def _init_worker():
+    # Needed where workers are spawned rather than forked.
+    django.setup()
+
+
+def hashing_pool(workers):
+    """Process pool for make_password(); None means hash in this process."""
+    if workers == 1:
+        return None
+    return ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_init_worker)
+
+
+def hash_passwords(passwords, pool=None):
+    if pool is None:
+        return [make_password(password) for password in passwords]
+    return list(pool.map(make_password, passwords, chunksize=HASH_BATCH))
+
+
+def _account(user, account_type, account_number=''):
+    symbol, code = get_currency_from_country(user.country)
+    return BankAccount(
+        user=user,
+        account_number=account_number,
+        account_type=account_type,
+        currency_symbol=symbol,
+        currency_code=code,
+    )
+
+
+def _conflict(user, error):
+    """Why a row failed to insert: the field taken since the up-front check, else the database error."""
+    if User.objects.filter(username=user.username).exists():
+        return "Username already exists."
+    if User.objects.filter(email=user.email).exists():
+        return "Email already exists."
+    return str(error)
+
+
+def import_chunk(entries, pool=None, account_type='Savings'):
+    """
+    Insert one chunk of validated (line, user, password) entries: two queries
+    to find taken usernames/emails, passwords hashed in the pool, then one
+    bulk_create for users and one for their accounts. If a row was taken
+    meanwhile the chunk is retried row by row, each in its own savepoint, so
+    only the conflicting rows are rejected.
+    Returns (imported count, [(line, username, error), ...]).
+    """
+    errors = []
+    taken_usernames = set(User.objects.filter(username__in=[u.username for _, u, _ in entries]).values_list('username', flat=True))
+    taken_emails = set(User.objects.filter(email__in=[u.email for _, u, _ in entries]).values_list('email', flat=True))
+
+    fresh = []
+    for line, user, password in entries:
+        if user.username in taken_usernames:
+            errors.append((line, user.username, "Username already exists."))
+        elif user.email in taken_emails:
+            errors.append((line, user.username, "Email already exists."))
+        else:
+            taken_usernames.add(user.username)
+            taken_emails.add(user.email)
+            fresh.append((line, user, password))
+    if not fresh:
+        return 0, errors
+
+    users = [user for _, user, _ in fresh]
+    for user, hashed in zip(users, hash_passwords([password for _, _, password in fresh], pool)):
+        user.password = hashed
+
+    try:
+        with transaction.atomic():
+            users = User.objects.bulk_create(users)
+            numbers = reserve_account_numbers(len(users))
+            BankAccount.objects.bulk_create([
+                _account(user, account_type, number) for user, number in zip(users, numbers)
+            ])
+        return len(users), errors
+    except IntegrityError:
+        # Someone registered one of these usernames/emails since the check.
+        pass
+
+    imported = 0
+    for line, user, _ in fresh:
+        try:
+            with transaction.atomic():
+                User.objects.bulk_create([user])
+                # save() draws the number and steps past any already taken.
+                _account(user, account_type).save()
+        except IntegrityError as e:
+            errors.append((line, user.username, _conflict(user, e)))
+        else:
+            imported += 1
+    errors.sort(key=lambda error: error[0])
+    return imported, errors
@@ -0,0 +1,82 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Substr
+
+from .models import Message, User
+from .pagination import keyset_page
+
+
+# Threads per page in the admin support inbox.
+INBOX_PAGE_SIZE = 50
+# Characters of the last message shown in the inbox.
+PREVIEW_LENGTH = 120
+
+
+def message_added(message):
+    """
+    Fold a new message into its user's thread summary (User.last_message,
+    last_message_at, unanswered_messages). The Message post_save signal calls
+    this; bulk writers call rebuild_threads() for the users they touched.
+    """
+    users = User.objects.filter(pk=message.user_id)
+    # A message committed out of order never replaces a newer one.
+    users.filter(Q(last_message__isnull=True) | Q(last_message__lt=message.pk)).update(
+        last_message=message, last_message_at=message.created_at
+    )
+    if message.sender == 'Admin':
+        users.update(unanswered_messages=0)
+    else:
+        users.update(unanswered_messages=F('unanswered_messages') + 1)
+
+
+def rebuild_threads(user_pks=None):
+    """
+    Recompute the thread summary from the Message table in one UPDATE.
+    Used after deletes and bulk writes. Returns the number of users updated.
+    """
+    latest = Message.objects.filter(user=OuterRef('pk')).order_by('-id')
+    last_reply = (
+        Message.objects.filter(user=OuterRef(OuterRef('pk')), sender='Admin')
+        .order_by('-id')
+        .values('id')[:1]
+    )
+    unanswered = (
+        Message.objects.filter(user=OuterRef('pk'), sender='User', id__gt=Coalesce(Subquery(last_reply), 0))
+        .order_by()
+        .values('user')
+        .annotate(total=Count('id'))
+        .values('total')
+    )
+    users = User.objects.all()
+    if user_pks is not None:
+        users = users.filter(pk__in=user_pks)
+    return users.update(
+        last_message=Subquery(latest.values('id')[:1]),
+        last_message_at=Subquery(latest.values('created_at')[:1]),
+        unanswered_messages=Coalesce(Subquery(unanswered, output_field=IntegerField()), Value(0)),
+    )
+
+
+def support_threads(waiting_only=False):
+    """
+    One row per user with messages, newest activity first, with last_sender,
+    last_preview and unanswered read from the denormalised thread summary.
+    The last message is a join on its primary key, so a page costs the same
+    however long the threads are.
+    """
+    threads = (
+        User.objects.only('id', 'username', 'email', 'last_message', 'last_message_at')
+        .filter(last_message_at__isnull=False)
+        .annotate(
+            last_sender=F('last_message__sender'),
+            last_preview=Substr('last_message__content', 1, PREVIEW_LENGTH),
+            unanswered=F('unanswered_messages'),
+        )
+    )
+    if waiting_only:
+        threads = threads.filter(unanswered_messages__gt=0)
+    return threads
+
+
+def inbox_page(cursor=None, waiting_only=False, page_size=INBOX_PAGE_SIZE):
+    """A page of support_threads() in one query. Returns (threads, next_cursor)."""
+    return keyset_page(support_threads(waiting_only), cursor, page_size, field='last_message_at')
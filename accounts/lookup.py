@@ -0,0 +1,126 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import BankAccount
+
+
+# Account numbers are always this many digits; anything else is rejected
+# without touching the cache or the database.
+ACCOUNT_NUMBER_LENGTH = 12
+# Entries kept per process, and how long one may be served after it was read.
+LOOKUP_CACHE_SIZE = 10000
+LOOKUP_TTL = 5 * 60  # seconds
+# Per-user lookup allowance: RATE_LIMIT lookups per RATE_LIMIT_WINDOW seconds.
+RATE_LIMIT = 20
+RATE_LIMIT_WINDOW = 60
+
+Recipient = namedtuple('Recipient', ['first_name', 'last_name', 'status'])
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Small thread-safe LRU with a per-entry TTL. Values may be None."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """The cached value, or _MISSING."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return _MISSING
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self._data[key]
+                return _MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class RateLimiter:
+    """
+    Fixed-window counter per key in the shared cache, so the limit holds
+    across processes that share a cache backend. add() starts a window and
+    incr() counts in it; both are atomic in the cache, so concurrent requests
+    can't both spend the last allowance. A key may see up to twice the limit
+    across a window boundary.
+    """
+
+    def __init__(self, name, limit, window):
+        self.name = name
+        self.limit = limit
+        self.window = window
+
+    def consume(self, key):
+        """Count one use; False once the key is over its limit for this window."""
+        cache_key = f"ratelimit:{self.name}:{key}:{int(time.time() // self.window)}"
+        if cache.add(cache_key, 1, self.window + 1):
+            return True
+        try:
+            count = cache.incr(cache_key)
+        except ValueError:
+            # Expired between add() and incr(): this use starts a new window.
+            cache.add(cache_key, 1, self.window + 1)
+            return True
+        return count <= self.limit
+
+
+recipients = LRUCache(LOOKUP_CACHE_SIZE, LOOKUP_TTL)
+lookup_limiter = RateLimiter('recipient-lookup', RATE_LIMIT, RATE_LIMIT_WINDOW)
+
+
+def is_account_number(value):
+    return len(value) == ACCOUNT_NUMBER_LENGTH and value.isdigit()
+
+
+def lookup_recipient(account_number):
+    """
+    Recipient(first_name, last_name, status) for an account number, or None.
+    Misses are cached too, so each distinct number costs at most one (joined)
+    query per LOOKUP_TTL. The cache is per process: forget_recipients() evicts
+    here, other processes catch up within LOOKUP_TTL.
+    """
+    if not is_account_number(account_number):
+        return None
+    recipient = recipients.get(account_number)
+    if recipient is _MISSING:
+        row = (
+            BankAccount.objects.filter(account_number=account_number)
+            .values_list('user__first_name', 'user__last_name', 'status')
+            .first()
+        )
+        recipient = Recipient(*row) if row else None
+        recipients.set(account_number, recipient)
+    return recipient
+
+
+def forget_recipients(*account_numbers):
+    """Evict account numbers once the current transaction commits."""
+    account_numbers = [number for number in account_numbers if number]
+    if account_numbers:
+        transaction.on_commit(lambda: recipients.delete(*account_numbers))
@@ -0,0 +1,75 @@
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, OperationalError
+
+from accounts.models import BankAccount, User
+from accounts.sharding import enable_sharding
+from accounts.transfers import apply_transaction
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare credit throughput into one hot account with and without balance sharding. "
+        "Creates a throwaway user/account and deletes it afterwards. Run against PostgreSQL; "
+        "SQLite serialises every writer, so its numbers say nothing about row contention."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=16, help="Concurrent writer threads.")
+        parser.add_argument('--credits', type=int, default=200, help="Credits per writer.")
+        parser.add_argument('--shards', type=int, default=8)
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite':
+            self.stdout.write(self.style.WARNING("SQLite locks the whole database per write; expect no difference."))
+
+        unsharded = self.run(options['writers'], options['credits'], shards=0)
+        sharded = self.run(options['writers'], options['credits'], shards=options['shards'])
+
+        self.stdout.write(f"unsharded: {unsharded:10.1f} credits/s")
+        self.stdout.write(f"sharded:   {sharded:10.1f} credits/s  ({options['shards']} shards)")
+        if unsharded:
+            self.stdout.write(self.style.SUCCESS(f"speed-up:  {sharded / unsharded:10.2f}x"))
+
+    def run(self, writers, credits, shards):
+        tag = uuid.uuid4().hex[:10]
+        user = User.objects.create(username=f"bench-{tag}", email=f"bench-{tag}@example.invalid")
+        account = BankAccount.objects.create(user=user, account_type='Savings')
+        if shards:
+            enable_sharding(account, shards)
+
+        failures = []
+        start_gate = threading.Barrier(writers + 1)
+
+        def writer():
+            try:
+                start_gate.wait()
+                for _ in range(credits):
+                    try:
+                        apply_transaction(account, Decimal('1.00'), 'credit', 'Benchmark credit')
+                    except OperationalError:
+                        failures.append(1)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=writer) for _ in range(writers)]
+        for thread in threads:
+            thread.start()
+        start_gate.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        account.refresh_from_db()
+        applied = writers * credits - len(failures)
+        label = f"{shards} shards" if shards else "unsharded"
+        self.stdout.write(
+            f"{label}: {applied} credits in {elapsed:.2f}s, balance {account.total_balance}, {len(failures)} failed"
+        )
+        user.delete()
+        return applied / elapsed if elapsed else 0.0
@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from accounts.storage import GC_GRACE, MANAGED_DIRS, collect_garbage
+
+
+class Command(BaseCommand):
+    help = (
+        f"Delete media files under {', '.join(MANAGED_DIRS)} that no User or Message row "
+        "references (photos, thumbnails, ID documents). Files newer than the grace period are "
+        "kept, since an upload is stored before its row commits."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float, default=GC_GRACE.total_seconds() / 3600)
+        parser.add_argument('--dry-run', action='store_true', help="List what would be deleted without deleting.")
+
+    def handle(self, *args, **options):
+        kept, deleted, freed = collect_garbage(grace=timedelta(hours=options['grace_hours']), dry_run=options['dry_run'])
+        if options['verbosity'] > 1 or options['dry_run']:
+            for name in deleted:
+                self.stdout.write(name)
+        verb = "Would delete" if options['dry_run'] else "Deleted"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {len(deleted)} unreferenced files ({freed / 1024 / 1024:.1f} MiB); {kept} referenced files kept."
+        ))
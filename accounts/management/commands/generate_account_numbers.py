@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.numbering import reserve_account_numbers
+
+
+class Command(BaseCommand):
+    help = (
+        "Reserve a batch of fresh account numbers (one claim against the allocator) and print "
+        "them one per line, for data imports that need numbers up front. Reserved numbers are "
+        "never handed out again, whether or not they end up used."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, required=True)
+        parser.add_argument('--output', help="File to write to instead of stdout.")
+
+    def handle(self, *args, **options):
+        if options['count'] < 1:
+            raise CommandError("--count must be at least 1.")
+        numbers = reserve_account_numbers(options['count'])
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write('\n'.join(numbers) + '\n')
+            self.stderr.write(self.style.SUCCESS(f"Wrote {len(numbers)} account numbers to {options['output']}."))
+        else:
+            self.stdout.write('\n'.join(numbers))
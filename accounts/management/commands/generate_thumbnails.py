@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from accounts.models import Message, User
+from accounts.thumbnails import CHAT_WIDTHS, PROFILE_WIDTHS, refresh_thumbnails
+
+
+class Command(BaseCommand):
+    help = (
+        "Render missing photo thumbnails for existing profile and chat photos. New uploads get "
+        "theirs on save; run this once after deploying and again with --force if the sizes change."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=['user', 'message'], action='append', dest='models',
+                            help="Only this model (repeatable). Defaults to both.")
+        parser.add_argument('--force', action='store_true', help="Re-render thumbnails that are already up to date.")
+
+    def handle(self, *args, **options):
+        targets = {'user': (User, PROFILE_WIDTHS), 'message': (Message, CHAT_WIDTHS)}
+        for name in options['models'] or targets:
+            model, widths = targets[name]
+            rows = (
+                model.objects.exclude(photo='').exclude(photo__isnull=True)
+                .only('pk', 'photo', 'photo_thumbnails')
+                .order_by('pk')
+                .iterator(chunk_size=500)
+            )
+            done = 0
+            for instance in rows:
+                if refresh_thumbnails(instance, widths, force=options['force']):
+                    done += 1
+                    if done % 100 == 0:
+                        self.stdout.write(f"{name}: {done} photos")
+            self.stdout.write(self.style.SUCCESS(f"Rendered thumbnails for {done} {model._meta.verbose_name_plural}."))
@@ -0,0 +1,80 @@
+import csv
+import os
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.imports import CHUNK_SIZE, FORMATS, hashing_pool, import_chunk, read_rows, validate_row
+
+
+class Command(BaseCommand):
+    help = (
+        "Import customers from a CSV or JSONL file (one user per row, columns named like the "
+        "registration form fields). Rows are validated with the registration rules, passwords "
+        "are hashed in a process pool and users/accounts are inserted in chunks. Rows that fail "
+        "are reported and skipped; the rest of the file still imports."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=sorted(set(FORMATS.values())),
+                            help="Defaults to the file extension.")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+        parser.add_argument('--workers', type=int, default=0,
+                            help="Password hashing processes. 0 = one per CPU, 1 = no pool.")
+        parser.add_argument('--account-type', choices=['Savings', 'Checking'], default='Savings')
+        parser.add_argument('--errors', help="Write the per-row error report to this CSV instead of stderr.")
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or FORMATS.get(os.path.splitext(options['path'])[1].lower())
+        if fmt is None:
+            raise CommandError("Cannot tell the file format from its extension; pass --format.")
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be at least 1.")
+
+        report_file = open(options['errors'], 'w', newline='') if options['errors'] else None
+        report = csv.writer(report_file or self.stderr)
+        report.writerow(['line', 'username', 'error'])
+
+        imported = failed = processed = 0
+        started = time.perf_counter()
+        pool = hashing_pool(options['workers'])
+        try:
+            with open(options['path'], newline='', encoding='utf-8-sig') as f:
+                rows = read_rows(f, fmt)
+                while chunk := list(islice(rows, options['chunk_size'])):
+                    entries, errors = [], []
+                    for line, row, error in chunk:
+                        if error is None:
+                            try:
+                                user, password = validate_row(row)
+                            except ValueError as e:
+                                error = str(e)
+                            else:
+                                entries.append((line, user, password))
+                                continue
+                        errors.append((line, (row or {}).get('username', ''), error))
+
+                    if entries:
+                        count, chunk_errors = import_chunk(entries, pool, options['account_type'])
+                        imported += count
+                        errors.extend(chunk_errors)
+                    report.writerows(sorted(errors))
+                    failed += len(errors)
+                    processed += len(chunk)
+
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(
+                        f"{processed} rows: {imported} imported, {failed} failed "
+                        f"({processed / elapsed if elapsed else 0:.0f} rows/s)"
+                    )
+        finally:
+            if pool is not None:
+                pool.shutdown()
+            if report_file:
+                report_file.close()
+
+        elapsed = time.perf_counter() - started
+        style = self.style.SUCCESS if not failed else self.style.WARNING
+        self.stdout.write(style(f"Imported {imported} of {processed} customers in {elapsed:.1f}s; {failed} failed."))
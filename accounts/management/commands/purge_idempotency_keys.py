@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from accounts.idempotency import purge_expired
+
+
+class Command(BaseCommand):
+    help = "Delete idempotency keys whose stored response has expired. Run from cron."
+
+    def handle(self, *args, **options):
+        deleted = purge_expired()
+        self.stdout.write(self.style.SUCCESS(f"Purged {deleted} expired idempotency keys."))
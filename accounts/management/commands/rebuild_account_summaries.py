@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from accounts.summaries import rebuild_summaries
+
+
+class Command(BaseCommand):
+    help = "Recompute per-account credit/debit totals from the Transaction ledger."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account', action='append', type=int, dest='accounts',
+                            help="BankAccount id to rebuild (repeatable). Defaults to all accounts.")
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        count = rebuild_summaries(options['accounts'], chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt summaries for {count} accounts."))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from accounts.unread import rebuild_unread_counts
+
+
+class Command(BaseCommand):
+    help = "Recount every user's unread admin replies from the Message table and clear the cached badges."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', type=int, dest='users',
+                            help="User id to rebuild (repeatable). Defaults to all users.")
+
+    def handle(self, *args, **options):
+        count = rebuild_unread_counts(options['users'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt unread counts for {count} users."))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import BankAccount
+from accounts.sharding import disable_sharding, enable_sharding
+
+
+class Command(BaseCommand):
+    help = "Turn balance sharding on or off for a high-volume receiving account."
+
+    def add_arguments(self, parser):
+        parser.add_argument('account_number')
+        parser.add_argument('--shards', type=int, default=8, help="Number of shard rows (default 8).")
+        parser.add_argument('--off', action='store_true', help="Fold the shards back and disable sharding.")
+
+    def handle(self, *args, **options):
+        try:
+            account = BankAccount.objects.get(account_number=options['account_number'])
+        except BankAccount.DoesNotExist:
+            raise CommandError("Account not found.")
+
+        if options['off']:
+            disable_sharding(account)
+            self.stdout.write(self.style.SUCCESS(f"Sharding disabled for {account.account_number}."))
+            return
+
+        if options['shards'] < 1:
+            raise CommandError("--shards must be at least 1.")
+        enable_sharding(account, options['shards'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{account.account_number} now spreads credits over {options['shards']} shards."
+        ))
@@ -0,0 +1,141 @@
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, HttpResponse
+
+from .models import Message
+from .storage import _thumbnail_names, content_store, is_content_addressed
+
+
+# Content-addressed files never change, but they are per-user: browser cache only.
+IMMUTABLE_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+MUTABLE_CACHE_CONTROL = 'private, no-cache'
+RANGE_HEADER = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def clean_media_name(path):
+    """Storage name for a /media/ path, or None if it tries to leave MEDIA_ROOT."""
+    name = posixpath.normpath(path).lstrip('/')
+    if name in ('', '.') or name.startswith('../') or name == '..' or '\\' in name:
+        return None
+    return name
+
+
+def may_access(user, name):
+    """
+    Staff see everything; customers see files one of their own rows points
+    to. Identical uploads share a file, so "owns" means "has a row that
+    references it", never "uploaded it first".
+    Profile photos and ID documents are checked on request.user without a query.
+    Chat photos and thumbnails are matched exactly; uploads from before
+    content addressing keep their original names, so those are allowed too.
+    """
+    if user.is_staff:
+        return True
+    if name in (user.photo.name, user.id_verification_document.name) or name in _thumbnail_names(user.photo_thumbnails):
+        return True
+    messages = Message.objects.filter(user=user)
+    if name.startswith('chat_photos/'):
+        return messages.filter(photo=name).exists()
+    if name.startswith('thumbs/'):
+        # Matching the quoted JSON string narrows the rows; the names are then compared exactly.
+        rows = messages.filter(photo_thumbnails__icontains=f'"{name}"').values_list('photo_thumbnails', flat=True)
+        return any(name in _thumbnail_names(thumbnails) for thumbnails in rows)
+    return False
+
+
+def _parse_range(header, size):
+    """(start, end) inclusive for a single 'bytes=' range, None to ignore it, or 'invalid' (416)."""
+    match = RANGE_HEADER.match(header.strip())
+    if not match:
+        return None  # Multiple or non-byte ranges: send the whole file.
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return 'invalid'
+    return start, end
+
+
+class RangeFile:
+    """Read-only view of bytes [start, start + length) of an open file, for FileResponse."""
+
+    def __init__(self, f, start, length):
+        f.seek(start)
+        self.file = f
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+async def _read_async(f, block_size):
+    read = sync_to_async(f.read, thread_sensitive=False)
+    while data := await read(block_size):
+        yield data
+
+
+def media_response(request, name, storage=content_store):
+    """
+    Hand the file to the front-end server when one is configured, otherwise
+    stream it with FileResponse (honouring a single Range request, so video
+    and large documents can be resumed/seeked). MEDIA_ACCEL is the intended
+    production setup: the fallback still occupies a worker for the transfer.
+    """
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    accel = settings.MEDIA_ACCEL
+    if accel:
+        if not storage.exists(name):
+            return None
+        response = HttpResponse(content_type=content_type)
+        if accel == 'nginx':
+            response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX.rstrip('/') + '/' + quote(name)
+        else:
+            response['X-Sendfile'] = storage.path(name)
+    else:
+        try:
+            f = storage.open(name, 'rb')
+        except (FileNotFoundError, IsADirectoryError):
+            return None
+        size = os.fstat(f.fileno()).st_size
+        byte_range = _parse_range(request.headers.get('Range', ''), size) if 'Range' in request.headers else None
+        if byte_range == 'invalid':
+            f.close()
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f"bytes */{size}"
+            return response
+        if byte_range:
+            start, end = byte_range
+            body = RangeFile(f, start, end - start + 1)
+            response = FileResponse(body, status=206, content_type=content_type)
+            response['Content-Range'] = f"bytes {start}-{end}/{size}"
+            response['Content-Length'] = str(end - start + 1)
+        else:
+            body = f
+            response = FileResponse(body, content_type=content_type)
+        if isinstance(request, ASGIRequest):
+            # Django buffers sync file iterators in full under ASGI; read in a thread instead.
+            response.streaming_content = _read_async(body, response.block_size)
+        response['Accept-Ranges'] = 'bytes'
+    response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if is_content_addressed(name) else MUTABLE_CACHE_CONTROL
+    return response
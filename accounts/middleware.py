@@ -0,0 +1,37 @@
+from asgiref.sync import iscoroutinefunction
+from django.utils.decorators import sync_and_async_middleware
+from django.utils.functional import SimpleLazyObject
+
+from .models import BankAccount
+
+
+def get_account(request):
+    """The signed-in user's BankAccount, or None. Cached on the request."""
+    if not hasattr(request, '_cached_account'):
+        account = None
+        if request.user.is_authenticated:
+            try:
+                # Already joined in by AccountBackend; a single query otherwise.
+                account = request.user.bankaccount
+            except BankAccount.DoesNotExist:
+                pass
+        request._cached_account = account
+    return request._cached_account
+
+
+@sync_and_async_middleware
+def account_middleware(get_response):
+    """
+    Sets a lazy request.account. It is falsy when the user has no account,
+    so test it with `if not request.account`, not `is None`.
+    Must come after AuthenticationMiddleware.
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            request.account = SimpleLazyObject(lambda: get_account(request))
+            return await get_response(request)
+    else:
+        def middleware(request):
+            request.account = SimpleLazyObject(lambda: get_account(request))
+            return get_response(request)
+    return middleware
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Q, Sum
+
+
+def backfill_summaries(apps, schema_editor):
+    BankAccount = apps.get_model('accounts', 'BankAccount')
+    Transaction = apps.get_model('accounts', 'Transaction')
+    AccountSummary = apps.get_model('accounts', 'AccountSummary')
+
+    totals = {
+        row['account']: row
+        for row in Transaction.objects.values('account').annotate(
+            total_credit=Sum('amount', filter=Q(type='credit')),
+            total_debit=Sum('amount', filter=Q(type='debit')),
+            credit_count=Count('id', filter=Q(type='credit')),
+            debit_count=Count('id', filter=Q(type='debit')),
+            last_transaction_at=Max('date'),
+        ).order_by()
+    }
+    AccountSummary.objects.bulk_create([
+        AccountSummary(
+            account_id=pk,
+            total_credit=totals.get(pk, {}).get('total_credit') or 0,
+            total_debit=totals.get(pk, {}).get('total_debit') or 0,
+            credit_count=totals.get(pk, {}).get('credit_count') or 0,
+            debit_count=totals.get(pk, {}).get('debit_count') or 0,
+            last_transaction_at=totals.get(pk, {}).get('last_transaction_at'),
+        )
+        for pk in BankAccount.objects.values_list('pk', flat=True)
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0018_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_credit', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('total_debit', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('credit_count', models.PositiveIntegerField(default=0)),
+                ('debit_count', models.PositiveIntegerField(default=0)),
+                ('last_transaction_at', models.DateTimeField(blank=True, null=True)),
+                ('account', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='summary', to='accounts.bankaccount')),
+            ],
+            options={
+                'verbose_name_plural': 'Account summaries',
+            },
+        ),
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+    ]
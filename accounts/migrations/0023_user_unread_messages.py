@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:11
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_unread(apps, schema_editor):
+    User = apps.get_model('accounts', 'User')
+    Message = apps.get_model('accounts', 'Message')
+
+    unread = (
+        Message.objects.filter(user=OuterRef('pk'), sender='Admin', is_read=False)
+        .order_by()
+        .values('user')
+        .annotate(total=Count('id'))
+        .values('total')
+    )
+    User.objects.update(unread_messages=Coalesce(Subquery(unread, output_field=IntegerField()), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0022_message_user_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='unread_messages',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_unread, migrations.RunPython.noop),
+    ]
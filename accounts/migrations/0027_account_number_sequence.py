@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:32
+
+from django.db import migrations, models
+
+
+FIRST_SERIAL = 10_000_000_000
+PG_SEQUENCE = 'accounts_account_number_block_seq'
+
+
+def create_sequence(apps, schema_editor):
+    AccountNumberSequence = apps.get_model('accounts', 'AccountNumberSequence')
+    AccountNumberSequence.objects.get_or_create(name='account_number', defaults={'next_value': FIRST_SERIAL})
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f"CREATE SEQUENCE IF NOT EXISTS {PG_SEQUENCE} START 1")
+
+
+def drop_sequence(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f"DROP SEQUENCE IF EXISTS {PG_SEQUENCE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0026_admin_date_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountNumberSequence',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('next_value', models.BigIntegerField()),
+            ],
+        ),
+        migrations.RunPython(create_sequence, drop_sequence),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:42
+
+import accounts.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0028_photo_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='photo',
+            field=models.ImageField(blank=True, null=True, storage=accounts.storage.ContentAddressedStorage(), upload_to='chat_photos/'),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='id_verification_document',
+            field=models.FileField(blank=True, null=True, storage=accounts.storage.ContentAddressedStorage(), upload_to='id_verifications/'),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='photo',
+            field=models.ImageField(blank=True, null=True, storage=accounts.storage.ContentAddressedStorage(), upload_to='profile_photos/'),
+        ),
+    ]
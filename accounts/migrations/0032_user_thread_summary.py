@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_threads(apps, schema_editor):
+    User = apps.get_model('accounts', 'User')
+    Message = apps.get_model('accounts', 'Message')
+
+    latest = Message.objects.filter(user=OuterRef('pk')).order_by('-id')
+    last_reply = (
+        Message.objects.filter(user=OuterRef(OuterRef('pk')), sender='Admin')
+        .order_by('-id')
+        .values('id')[:1]
+    )
+    unanswered = (
+        Message.objects.filter(user=OuterRef('pk'), sender='User', id__gt=Coalesce(Subquery(last_reply), 0))
+        .order_by()
+        .values('user')
+        .annotate(total=Count('id'))
+        .values('total')
+    )
+    User.objects.update(
+        last_message=Subquery(latest.values('id')[:1]),
+        last_message_at=Subquery(latest.values('created_at')[:1]),
+        unanswered_messages=Coalesce(Subquery(unanswered, output_field=IntegerField()), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0031_outbox_sending_status'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='last_message',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='accounts.message'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='unanswered_messages',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['-last_message_at', '-id'], name='user_last_message_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(condition=models.Q(('unanswered_messages__gt', 0)), fields=['-last_message_at', '-id'], name='user_waiting_thread_idx'),
+        ),
+        migrations.RunPython(backfill_threads, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:08
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0032_user_thread_summary'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='message',
+            name='msg_user_sender_id_idx',
+        ),
+    ]
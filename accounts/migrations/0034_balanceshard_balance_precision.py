@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0033_remove_message_user_sender_id_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='balanceshard',
+            name='balance',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+    ]
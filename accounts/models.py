@@ -1,9 +1,11 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import IntegrityError, models, transaction
 import uuid
 from datetime import timedelta
 from django.utils.timezone import now
 
+from .storage import content_store
+
 
 class User(AbstractUser):
     user_id = models.UUIDField(default=uuid.uuid4, editable=False)  # Unique user identifier
@@ -29,9 +31,35 @@ class User(AbstractUser):
 
     # ID Verification Fields
     id_verification_number = models.CharField(max_length=50, blank=True, null=True)
-    id_verification_document = models.FileField(upload_to='id_verifications/', blank=True, null=True)
+    id_verification_document = models.FileField(upload_to='id_verifications/', storage=content_store, blank=True, null=True)
+
+    photo = models.ImageField(upload_to='profile_photos/', storage=content_store, blank=True, null=True)
+    # Downscaled copies of photo, written by accounts.thumbnails.
+    photo_thumbnails = models.JSONField(default=dict, blank=True, editable=False)
 
-    photo = models.ImageField(upload_to='profile_photos/', blank=True, null=True)
+    # Unread admin replies, kept in step by accounts.unread (cached there).
+    unread_messages = models.PositiveIntegerField(default=0, editable=False)
+
+    # Support thread summary, kept in step by accounts.inbox so the inbox pages
+    # on an index instead of scanning every thread.
+    last_message = models.ForeignKey(
+        'Message', null=True, blank=True, on_delete=models.SET_NULL, related_name='+', editable=False
+    )
+    last_message_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # User messages since the last admin reply.
+    unanswered_messages = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Support inbox: threads newest activity first.
+            models.Index(fields=['-last_message_at', '-id'], name='user_last_message_idx'),
+            # Support inbox "waiting for a reply": only threads with unanswered messages.
+            models.Index(
+                fields=['-last_message_at', '-id'],
+                name='user_waiting_thread_idx',
+                condition=models.Q(unanswered_messages__gt=0),
+            ),
+        ]
 
     def __str__(self):
         return f"{self.username} ({self.email})"
@@ -51,24 +79,62 @@ class BankAccount(models.Model):
         default='Active'
     )
     transaction_pin = models.CharField(max_length=128, blank=True, null=True)
+    # Opt-in for very hot receiving accounts: credits are spread over this many
+    # BalanceShard rows instead of all queuing on this one. 0 = off.
+    balance_shards = models.PositiveSmallIntegerField(default=0)
+
+    @property
+    def total_balance(self):
+        """Balance to show the customer: the main balance plus any sharded credits."""
+        if not self.balance_shards:
+            return self.balance
+        return self.balance + (self.shards.aggregate(total=models.Sum('balance'))['total'] or 0)
 
     def save(self, *args, **kwargs):
-        if not self.account_number:
+        if self.account_number:
+            return super().save(*args, **kwargs)
+        # Numbers come from accounts.numbering and are unique by construction, but
+        # older random numbers can sit anywhere in the range; skip past one if hit.
+        for attempt in range(3):
             self.account_number = self.generate_account_number()
-        super().save(*args, **kwargs)
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                if not BankAccount.objects.filter(account_number=self.account_number).exists() or attempt == 2:
+                    self.account_number = ''
+                    raise
 
     @staticmethod
     def generate_account_number():
-        # Generate a 12-digit account number and ensure uniqueness
-        account_number = str(uuid.uuid4().int)[:12]
-        while BankAccount.objects.filter(account_number=account_number).exists():
-            account_number = str(uuid.uuid4().int)[:12]
-        return account_number
+        from .numbering import allocate_account_number
+        return allocate_account_number()
 
     def __str__(self):
         return f"{self.user.username} - {self.account_number}"
 
 
+class BalanceShard(models.Model):
+    """
+    One slice of a sharded account's incoming credits (see accounts.sharding).
+    Debits fold every shard back into BankAccount.balance under lock.
+    """
+    account = models.ForeignKey(BankAccount, on_delete=models.CASCADE, related_name='shards')
+    index = models.PositiveSmallIntegerField()
+    # Same precision as BankAccount.balance, which collapse_shards() folds it into.
+    balance = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Summary counters for credits that landed here, folded into AccountSummary with the balance.
+    credit_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    credit_count = models.PositiveIntegerField(default=0)
+    last_credit_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('account', 'index')
+
+    def __str__(self):
+        return f"{self.account.account_number} shard {self.index}"
+
+
 class Transaction(models.Model):
     account = models.ForeignKey(BankAccount, on_delete=models.CASCADE)
     date = models.DateTimeField(auto_now_add=True)
@@ -80,10 +146,38 @@ class Transaction(models.Model):
     ]
     type = models.CharField(max_length=10, choices=TRANSACTION_TYPES)
 
+    class Meta:
+        indexes = [
+            # Dashboard / history: filter by account, newest first (id breaks date ties).
+            models.Index(fields=['account', '-date', '-id'], name='txn_account_date_idx'),
+            # Admin date_hierarchy drill-down across all accounts.
+            models.Index(fields=['date'], name='txn_date_idx'),
+        ]
+
     def __str__(self):
         return f"{self.account.account_number} - {self.type} - ${self.amount}"
 
 
+class AccountSummary(models.Model):
+    """
+    Running per-account totals, maintained in the same database transaction
+    as every balance change (see accounts.summaries). Lets the history page
+    show totals without aggregating the whole ledger.
+    """
+    account = models.OneToOneField(BankAccount, on_delete=models.CASCADE, related_name='summary')
+    total_credit = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    total_debit = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    credit_count = models.PositiveIntegerField(default=0)
+    debit_count = models.PositiveIntegerField(default=0)
+    last_transaction_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = "Account summaries"
+
+    def __str__(self):
+        return f"Summary for {self.account.account_number}"
+
+
 class CardRequest(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     date_requested = models.DateTimeField(auto_now_add=True)
@@ -138,7 +232,8 @@ class Message(models.Model):
     sender = models.CharField(max_length=100, choices=[('Admin', 'Admin'), ('User', 'User')], default='User')
     subject = models.CharField(max_length=100, blank=True, null=True)
     content = models.TextField(blank=True)
-    photo = models.ImageField(upload_to='chat_photos/', blank=True, null=True)
+    photo = models.ImageField(upload_to='chat_photos/', storage=content_store, blank=True, null=True)
+    photo_thumbnails = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.CASCADE, related_name='replies')
     is_read = models.BooleanField(default=False)
@@ -149,7 +244,114 @@ class Message(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Chat page and fetch_messages: one user's thread in time order.
+            models.Index(fields=['user', 'created_at'], name='msg_user_created_idx'),
+            # Chat delta sync: one user's messages after an id cursor.
+            models.Index(fields=['user', 'id'], name='msg_user_id_idx'),
+            # Admin date_hierarchy drill-down across all users.
+            models.Index(fields=['created_at'], name='msg_created_idx'),
+            # Unread badge: user + sender + is_read.
+            models.Index(fields=['user', 'sender', 'is_read'], name='msg_user_sender_read_idx'),
+            # Partial index holding only unread admin replies (PostgreSQL/SQLite; ignored elsewhere).
+            models.Index(
+                fields=['user'],
+                name='msg_unread_admin_idx',
+                condition=models.Q(sender='Admin', is_read=False),
+            ),
+        ]
 
     def lastest_thread(self):
         """ Returns the root message of this user's latest thread. """
-        return Message.objects.filter(user=self.user, parent__isnull=True).order_by('-created_at').first()
\ No newline at end of file
+        return Message.objects.filter(user=self.user, parent__isnull=True).order_by('-created_at').first()
+
+class IdempotencyKey(models.Model):
+    """
+    Remembers the response to a money-moving POST so a double-click or client
+    retry with the same key replays it instead of running the write again.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    endpoint = models.CharField(max_length=100)
+    # Null until the original request finishes; a claimed-but-unfinished key is "in flight".
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    location = models.CharField(max_length=500, blank=True)
+    body = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # When the request now holding the key started; refreshed on takeover.
+    claimed_at = models.DateTimeField(default=now)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ('user', 'key')
+
+    def is_expired(self):
+        return now() >= self.expires_at
+
+    def __str__(self):
+        return f"{self.user.username} - {self.endpoint} - {self.key}"
+
+
+class OutboundEmail(models.Model):
+    """
+    Email written in the same transaction as the change it reports and sent
+    later by `manage.py send_outbox`, so request handlers never wait on SMTP.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    is_html = models.BooleanField(default=False)
+    from_email = models.CharField(max_length=255, blank=True)
+    recipients = models.TextField(help_text="Comma separated addresses.")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    next_attempt_at = models.DateTimeField(default=now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The worker's "what is due" query.
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {self.recipients} ({self.status})"
+
+
+class AuditLog(models.Model):
+    """
+    One row per admin bulk action: who did what to which rows. A freeze of
+    10,000 accounts is a single record listing their ids, not 10,000 rows.
+    """
+    actor = models.ForeignKey(User, null=True, on_delete=models.SET_NULL, related_name='audit_logs')
+    action = models.CharField(max_length=50)
+    model = models.CharField(max_length=100)
+    object_ids = models.JSONField(default=list)
+    count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.action} on {self.count} {self.model} by {self.actor}"
+
+
+class AccountNumberSequence(models.Model):
+    """
+    Counter behind accounts.numbering on databases without sequences: each
+    process claims a block of serials by bumping next_value in one UPDATE.
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    next_value = models.BigIntegerField()
+
+    def __str__(self):
+        return f"{self.name}: {self.next_value}"
@@ -0,0 +1,125 @@
+import threading
+
+from django.db import connection, connections, transaction
+
+from .models import AccountNumberSequence
+
+
+# Account numbers are an 11-digit serial plus a Luhn check digit.
+FIRST_SERIAL = 10_000_000_000
+LAST_SERIAL = 99_999_999_999
+# Serials each process reserves at a time.
+BLOCK_SIZE = 100
+SEQUENCE_NAME = 'account_number'
+# PostgreSQL sequence backing claim_block(); see migration 0027.
+PG_SEQUENCE = 'accounts_account_number_block_seq'
+
+
+def luhn_check_digit(payload):
+    total = 0
+    for position, char in enumerate(reversed(payload)):
+        digit = int(char)
+        if position % 2 == 0:
+            digit *= 2
+            if digit > 9:
+                digit -= 9
+        total += digit
+    return str((10 - total % 10) % 10)
+
+
+def with_check_digit(serial):
+    payload = str(serial)
+    return payload + luhn_check_digit(payload)
+
+
+def is_valid_account_number(number):
+    """Format and check digit only; says nothing about whether the account exists."""
+    return len(number) == 12 and number.isdigit() and luhn_check_digit(number[:-1]) == number[-1]
+
+
+def _bump_sequence(cursor, size):
+    """Advance AccountNumberSequence by size; returns the new end (exclusive)."""
+    table = AccountNumberSequence._meta.db_table
+    cursor.execute(
+        f"UPDATE {table} SET next_value = next_value + %s WHERE name = %s RETURNING next_value",
+        [size, SEQUENCE_NAME],
+    )
+    row = cursor.fetchone()
+    if row is not None:
+        return row[0]
+    cursor.execute(
+        f"INSERT INTO {table} (name, next_value) VALUES (%s, %s)",
+        [SEQUENCE_NAME, FIRST_SERIAL + size],
+    )
+    return FIRST_SERIAL + size
+
+
+def claim_block(size=BLOCK_SIZE):
+    """
+    Reserve `size` serials and return them as a list, ascending.
+
+    The reservation commits on its own, so a block handed out to this
+    process is never handed out again if the caller's transaction rolls
+    back. On PostgreSQL the block comes from a sequence, which never rolls
+    back. Elsewhere it is an UPDATE ... RETURNING on AccountNumberSequence,
+    in a durable transaction or, inside the caller's transaction, on a
+    connection of its own. SQLite allows one writer, so there the claim has
+    to share the caller's transaction; a block reissued after a rollback
+    collides on the unique account number and BankAccount.save() retries.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT nextval(%s) FROM generate_series(1, %s)", [PG_SEQUENCE, size])
+            values = [row[0] for row in cursor.fetchall()]
+        # Concurrent claims may interleave, so the values need not be contiguous.
+        return [FIRST_SERIAL + value - 1 for value in values]
+
+    if not connection.in_atomic_block:
+        with transaction.atomic(durable=True), connection.cursor() as cursor:
+            end = _bump_sequence(cursor, size)
+    elif connection.vendor == 'sqlite':
+        with transaction.atomic(), connection.cursor() as cursor:
+            end = _bump_sequence(cursor, size)
+    else:
+        # Autocommit on a separate connection: the single UPDATE commits at once.
+        claim_connection = connections.create_connection(connection.alias)
+        try:
+            with claim_connection.cursor() as cursor:
+                end = _bump_sequence(cursor, size)
+        finally:
+            claim_connection.close()
+    return list(range(end - size, end))
+
+
+class Allocator:
+    """Hands out account numbers from a block reserved by this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._serials = iter(())
+
+    def allocate(self):
+        with self._lock:
+            serial = next(self._serials, None)
+            if serial is None:
+                self._serials = iter(claim_block())
+                serial = next(self._serials)
+        if serial > LAST_SERIAL:
+            raise RuntimeError("Account number space exhausted.")
+        return with_check_digit(serial)
+
+    def reset(self):
+        with self._lock:
+            self._serials = iter(())
+
+
+allocator = Allocator()
+
+
+def allocate_account_number():
+    return allocator.allocate()
+
+
+def reserve_account_numbers(count):
+    """count fresh account numbers in one claim (for bulk imports)."""
+    return [with_check_digit(serial) for serial in claim_block(count)]
@@ -0,0 +1,132 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection as db_connection, transaction
+from django.db.models import F
+from django.utils.timezone import now
+
+from .models import OutboundEmail
+
+
+logger = logging.getLogger(__name__)
+
+# Give up on a message after this many failed sends.
+MAX_ATTEMPTS = 5
+# Retry delay is RETRY_BASE * 2 ** (attempts - 1), capped at RETRY_CAP.
+RETRY_BASE = timedelta(minutes=1)
+RETRY_CAP = timedelta(hours=1)
+# How long a claimed email is reserved for the worker sending it.
+CLAIM_LEASE = timedelta(minutes=10)
+
+
+def queue_email(subject, message, recipient_list, from_email=None, html=False):
+    """
+    Drop-in for send_mail() inside request handlers: writes the email to the
+    outbox in the current transaction instead of talking to SMTP. If the
+    transaction rolls back, the email is never sent.
+    """
+    return OutboundEmail.objects.create(
+        subject=subject,
+        body=message,
+        is_html=html,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        recipients=','.join(recipient_list),
+    )
+
+
+def _as_message(email, connection):
+    message = EmailMessage(
+        email.subject,
+        email.body,
+        email.from_email or settings.DEFAULT_FROM_EMAIL,
+        [address for address in email.recipients.split(',') if address],
+        connection=connection,
+    )
+    if email.is_html:
+        message.content_subtype = 'html'
+    return message
+
+
+def _claim(batch_size):
+    """
+    Take up to batch_size due emails for this worker and commit straight away:
+    they become 'sending' with next_attempt_at pushed out by CLAIM_LEASE, so
+    other workers skip them and no row lock is held while SMTP runs. If this
+    worker dies mid-batch, the lease runs out and the emails are due again.
+    """
+    claimed_until = now() + CLAIM_LEASE
+    with transaction.atomic():
+        emails = OutboundEmail.objects.filter(
+            status__in=['pending', 'sending'], next_attempt_at__lte=now()
+        ).order_by('next_attempt_at', 'id')
+        if db_connection.features.has_select_for_update_skip_locked:
+            # Several workers can drain the outbox without picking the same rows.
+            emails = emails.select_for_update(skip_locked=True)
+        emails = list(emails[:batch_size])
+        OutboundEmail.objects.filter(pk__in=[email.pk for email in emails]).update(
+            status='sending', attempts=F('attempts') + 1, next_attempt_at=claimed_until
+        )
+    for email in emails:
+        email.attempts += 1
+    return emails
+
+
+def deliver_batch(connection, batch_size=100):
+    """
+    Send up to batch_size due emails over an already open mail connection.
+    Each result is written on its own as soon as the email is sent or fails,
+    so a crash part way through re-sends at most the email in progress.
+    Failures are rescheduled with exponential backoff; after MAX_ATTEMPTS
+    the email is marked failed.
+    Returns (sent, failed) counts for this batch.
+    """
+    sent = failed = 0
+    for email in _claim(batch_size):
+        outcome = OutboundEmail.objects.filter(pk=email.pk)
+        try:
+            connection.send_messages([_as_message(email, connection)])
+        except Exception as e:
+            failed += 1
+            if email.attempts >= MAX_ATTEMPTS:
+                outcome.update(status='failed', last_error=str(e)[:1000])
+            else:
+                outcome.update(
+                    status='pending',
+                    last_error=str(e)[:1000],
+                    next_attempt_at=now() + min(RETRY_CAP, RETRY_BASE * 2 ** (email.attempts - 1)),
+                )
+            logger.warning(f"Outbox email {email.pk} failed (attempt {email.attempts}): {e}")
+            # The SMTP session may be broken; start a fresh one for the rest.
+            connection.close()
+            try:
+                connection.open()
+            except Exception:
+                pass  # send_messages() will try again (and fail) per email
+        else:
+            sent += 1
+            outcome.update(status='sent', sent_at=now(), last_error='')
+    return sent, failed
+
+
+def drain(batch_size=100, max_batches=None):
+    """
+    Send everything that is due, reusing one mail connection for all batches.
+    Returns (sent, failed) totals.
+    """
+    total_sent = total_failed = 0
+    batches = 0
+    connection = get_connection(fail_silently=False)
+    connection.open()
+    try:
+        while max_batches is None or batches < max_batches:
+            sent, failed = deliver_batch(connection, batch_size)
+            total_sent += sent
+            total_failed += failed
+            batches += 1
+            if sent + failed < batch_size:
+                break
+    finally:
+        connection.close()
+    return total_sent, total_failed
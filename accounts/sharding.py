@@ -0,0 +1,104 @@
+import random
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Max, Sum
+from django.utils.timezone import now
+
+from .models import BalanceShard, BankAccount
+from .summaries import record_activity
+
+
+def shard_credit(account_pk, shards, amount, count=1, **conditions):
+    """
+    Credit one randomly chosen shard of a sharded account. Concurrent credits
+    to the same account mostly hit different rows, so they stop queuing on
+    a single row lock. The shard also counts the credit for AccountSummary.
+    conditions filter on the parent account (e.g. status='Active').
+    Returns True if a shard row was updated.
+    """
+    conditions = {f'account__{name}': value for name, value in conditions.items()}
+    updated = BalanceShard.objects.filter(
+        account_id=account_pk, index=random.randrange(shards), **conditions
+    ).update(
+        balance=F('balance') + amount,
+        credit_total=F('credit_total') + amount,
+        credit_count=F('credit_count') + count,
+        last_credit_at=now(),
+    )
+    return updated == 1
+
+
+def collapse_shards(account_pk):
+    """
+    Fold every shard into BankAccount.balance and zero the shards, so a debit
+    sees the full balance. The account row is locked first and then the
+    shard rows in index order, which blocks in-flight credits and gives a
+    consistent total. Account before shards is the lock order every writer
+    follows (see accounts.transfers._transfer).
+    Returns the amount folded in.
+    """
+    list(BankAccount.objects.select_for_update().filter(pk=account_pk).values_list('pk', flat=True))
+    shards = list(
+        BalanceShard.objects.select_for_update().filter(account_id=account_pk).order_by('index')
+    )
+    folded = sum((shard.balance for shard in shards), Decimal('0'))
+    credit_total = sum((shard.credit_total for shard in shards), Decimal('0'))
+    credit_count = sum(shard.credit_count for shard in shards)
+    if not credit_count and not folded:
+        return Decimal('0')
+
+    BankAccount.objects.filter(pk=account_pk).update(balance=F('balance') + folded)
+    BalanceShard.objects.filter(pk__in=[shard.pk for shard in shards]).update(
+        balance=0, credit_total=0, credit_count=0, last_credit_at=None
+    )
+    if credit_count:
+        record_activity(
+            account_pk,
+            credit=credit_total,
+            credits=credit_count,
+            at=max((shard.last_credit_at for shard in shards if shard.last_credit_at), default=None),
+        )
+    return folded
+
+
+def pending_shard_totals(account):
+    """
+    Shard counters not yet folded into AccountSummary:
+    {'balance', 'credit_total', 'credit_count', 'last_credit_at'}.
+    """
+    totals = account.shards.aggregate(
+        balance=Sum('balance'),
+        credit_total=Sum('credit_total'),
+        credit_count=Sum('credit_count'),
+        last_credit_at=Max('last_credit_at'),
+    )
+    for key in ('balance', 'credit_total', 'credit_count'):
+        totals[key] = totals[key] or 0
+    return totals
+
+
+def enable_sharding(account, shards):
+    """Turn sharding on (or change the shard count) for an account."""
+    if shards < 1:
+        raise ValueError("Use disable_sharding() to turn sharding off.")
+    with transaction.atomic():
+        if account.balance_shards > shards:
+            # Shrinking: fold everything first so the dropped shards are empty.
+            collapse_shards(account.pk)
+            BalanceShard.objects.filter(account=account, index__gte=shards).delete()
+        BalanceShard.objects.bulk_create(
+            [BalanceShard(account=account, index=index) for index in range(shards)],
+            ignore_conflicts=True,
+        )
+        BankAccount.objects.filter(pk=account.pk).update(balance_shards=shards)
+    account.balance_shards = shards
+
+
+def disable_sharding(account):
+    """Fold all shards back into the main balance and remove them."""
+    with transaction.atomic():
+        collapse_shards(account.pk)
+        BankAccount.objects.filter(pk=account.pk).update(balance_shards=0)
+        BalanceShard.objects.filter(account=account).delete()
+    account.balance_shards = 0
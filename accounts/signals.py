@@ -0,0 +1,119 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .events import publish_message, publish_unread
+from .inbox import message_added, rebuild_threads
+from .lookup import forget_recipients
+from .models import BankAccount, CardRequest, Message, Transaction, User
+from .snapshots import invalidate_dashboard
+from .unread import rebuild_unread_counts, reply_added
+from .thumbnails import CHAT_WIDTHS, PROFILE_WIDTHS, refresh_thumbnails
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_save, sender=User)
+def make_photo_thumbnails(sender, instance, update_fields=None, **kwargs):
+    """
+    Render thumbnails when photo changes. Runs before push_new_message's
+    on_commit push, so the pushed message already carries them.
+    """
+    if update_fields is not None and 'photo' not in update_fields:
+        return
+    refresh_thumbnails(instance, PROFILE_WIDTHS if sender is User else CHAT_WIDTHS)
+
+
+@receiver(post_save, sender=Message)
+def count_unread_reply(sender, instance, created, **kwargs):
+    """
+    Keep User.unread_messages in step with every new admin reply, whoever
+    creates it. Connected before push_new_message, so the cached badge is
+    invalidated before the push reads it.
+    """
+    if created and instance.sender == 'Admin' and not instance.is_read:
+        reply_added(instance.user_id)
+
+
+@receiver(post_save, sender=Message)
+def track_thread(sender, instance, created, **kwargs):
+    """Keep the user's support thread summary (accounts.inbox) current."""
+    if created:
+        message_added(instance)
+
+
+def _rebuild_once_committed(user_id):
+    """
+    Queue user_id for one recount of the thread summary and unread count when
+    the transaction commits. A cascade deleting many messages shares a single
+    callback; users deleted in the same transaction are skipped.
+    """
+    connection = transaction.get_connection()
+    pending = getattr(connection, 'pending_message_rebuild', None)
+    # A callback dropped by a rolled-back savepoint is no longer queued.
+    if pending is None or not any(func is pending for _, func, _ in connection.run_on_commit):
+        def pending():
+            users = list(User.objects.filter(pk__in=pending.user_ids).values_list('pk', flat=True))
+            if users:
+                rebuild_threads(users)
+                rebuild_unread_counts(users)
+
+        pending.user_ids = {user_id}
+        connection.pending_message_rebuild = pending
+        transaction.on_commit(pending)
+    else:
+        pending.user_ids.add(user_id)
+
+
+@receiver(post_delete, sender=Message)
+def recount_after_delete(sender, instance, **kwargs):
+    """Deleted messages: the thread summary and unread count are rebuilt once per transaction."""
+    _rebuild_once_committed(instance.user_id)
+
+
+@receiver(post_save, sender=Message)
+def push_new_message(sender, instance, created, **kwargs):
+    """Push new chat messages (and the new badge count) to open SSE streams once committed."""
+    if not created:
+        return
+
+    def push():
+        publish_message(instance)
+        if instance.sender == 'Admin':
+            publish_unread(instance.user_id)
+
+    transaction.on_commit(push)
+
+
+@receiver([post_save, post_delete], sender=Message)
+@receiver([post_save, post_delete], sender=CardRequest)
+@receiver([post_save, post_delete], sender=BankAccount)
+def drop_dashboard_snapshot(sender, instance, **kwargs):
+    """Row-level saves of anything the dashboard shows. Bulk writes call invalidate_dashboard() themselves."""
+    invalidate_dashboard(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=Transaction)
+def drop_dashboard_snapshot_for_transaction(sender, instance, **kwargs):
+    """
+    Transactions written outside the transfer engine (admin edits, cascades
+    from an account delete). The engine passes the account in, so the lookup
+    is usually free; otherwise it is one primary key query.
+    """
+    if Transaction.account.is_cached(instance):
+        user_id = instance.account.user_id
+    else:
+        user_id = BankAccount.objects.filter(pk=instance.account_id).values_list('user_id', flat=True).first()
+    invalidate_dashboard(user_id)
+
+
+@receiver([post_save, post_delete], sender=BankAccount)
+def drop_cached_recipient(sender, instance, **kwargs):
+    forget_recipients(instance.account_number)
+
+
+@receiver(post_save, sender=User)
+def drop_cached_recipient_names(sender, instance, created, update_fields=None, **kwargs):
+    """Name changes only; skips the last_login save on every sign-in."""
+    if created or (update_fields is not None and not {'first_name', 'last_name'} & set(update_fields)):
+        return
+    forget_recipients(*BankAccount.objects.filter(user=instance).values_list('account_number', flat=True))
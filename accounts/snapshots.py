@@ -0,0 +1,59 @@
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import CardRequest, Message, Transaction
+
+
+# Snapshots are dropped by write paths; the timeout only bounds leftovers.
+SNAPSHOT_TIMEOUT = 60 * 60
+# Rows of each list kept in the snapshot (the dashboard shows fewer).
+SNAPSHOT_ROWS = 10
+
+
+def _version_key(user_id):
+    return f"dashboard:version:{user_id}"
+
+
+def _version(user_id):
+    version = cache.get(_version_key(user_id))
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(_version_key(user_id), version, SNAPSHOT_TIMEOUT):
+            version = cache.get(_version_key(user_id), version)
+    return version
+
+
+def build_snapshot(user, account):
+    """The dashboard's lists. The account itself comes fresh with each request (request.account)."""
+    return {
+        'chat_messages': list(Message.objects.filter(user=user).order_by('-created_at')[:SNAPSHOT_ROWS]),
+        'transactions': list(Transaction.objects.filter(account=account).order_by('-date')[:SNAPSHOT_ROWS]),
+        'card_requests': list(CardRequest.objects.filter(user=user).order_by('-date_requested')[:SNAPSHOT_ROWS]),
+    }
+
+
+def dashboard_snapshot(user, account):
+    """
+    Cached build_snapshot(user, account). While nothing changes this is two cache gets
+    and no queries. Snapshots are stored under a per-user version token, so
+    invalidating is one cache write and a snapshot built from data read
+    before a commit can never be served after it.
+    """
+    key = f"dashboard:{user.pk}:{_version(user.pk)}"
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = build_snapshot(user, account)
+        cache.set(key, snapshot, SNAPSHOT_TIMEOUT)
+    return snapshot
+
+
+def invalidate_dashboard(*user_ids):
+    """Drop these users' snapshots once the current transaction commits."""
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    if not user_ids:
+        return
+    transaction.on_commit(lambda: cache.set_many(
+        {_version_key(user_id): uuid.uuid4().hex for user_id in user_ids}, SNAPSHOT_TIMEOUT
+    ))
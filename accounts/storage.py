@@ -0,0 +1,135 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from collections import Counter
+from datetime import timedelta
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+from django.utils.timezone import now
+
+
+logger = logging.getLogger(__name__)
+
+# Top-level media folders the garbage collector owns.
+MANAGED_DIRS = ('chat_photos', 'profile_photos', 'id_verifications', 'thumbs')
+# Unreferenced files younger than this are kept: an upload is written before
+# the row that points to it is committed.
+GC_GRACE = timedelta(hours=24)
+TEMP_PREFIX = '.upload-'
+CONTENT_ADDRESSED = re.compile(r'(?:^|/)([0-9a-f]{2})/\1[0-9a-f]{62}(?:\.[\w]+)?$')
+
+
+def is_content_addressed(name):
+    return bool(CONTENT_ADDRESSED.search(name))
+
+
+@deconstructible(path='accounts.storage.ContentAddressedStorage')
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores each upload as <top-level dir>/<aa>/<sha256><ext>, so a name never
+    points at different bytes and identical uploads share one file.
+    The digest is computed while the upload is copied in, one pass over the
+    data. Files may be shared between rows, so nothing deletes them on row
+    changes; collect_garbage() removes files no row references.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # _save() picks the final name; identical content reuses it on purpose.
+        return name
+
+    def _save(self, name, content):
+        directory = name.split('/', 1)[0] if '/' in name else ''
+        extension = os.path.splitext(name)[1].lower()
+        os.makedirs(self.path(directory), exist_ok=True)
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=self.path(directory), prefix=TEMP_PREFIX)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    f.write(chunk)
+            hexdigest = digest.hexdigest()
+            final = '/'.join(part for part in (directory, hexdigest[:2], hexdigest + extension) if part)
+            full_path = self.path(final)
+            try:
+                # Reusing an existing file: touch it, so collect_garbage() sees it
+                # as new and leaves it alone until this upload's row is saved.
+                os.utime(full_path)
+            except FileNotFoundError:
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                os.chmod(temp_path, self.file_permissions_mode or 0o644)
+                # Atomic: concurrent identical uploads both end up with one complete file.
+                os.replace(temp_path, full_path)
+            else:
+                os.remove(temp_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return final
+
+
+content_store = ContentAddressedStorage()
+
+
+def _walk(storage, directory):
+    try:
+        directories, files = storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in files:
+        yield f"{directory}/{name}"
+    for sub in directories:
+        yield from _walk(storage, f"{directory}/{sub}")
+
+
+def referenced_files():
+    """Counter of media names referenced by User/Message rows (photos, thumbnails, ID documents)."""
+    from .models import Message, User
+
+    refs = Counter()
+    rows = User.objects.values_list('photo', 'photo_thumbnails', 'id_verification_document').iterator(chunk_size=2000)
+    for photo, thumbnails, document in rows:
+        refs.update(name for name in (photo, document) if name)
+        refs.update(_thumbnail_names(thumbnails))
+    rows = Message.objects.exclude(photo='').exclude(photo__isnull=True).values_list('photo', 'photo_thumbnails')
+    for photo, thumbnails in rows.iterator(chunk_size=2000):
+        refs[photo] += 1
+        refs.update(_thumbnail_names(thumbnails))
+    return refs
+
+
+def _thumbnail_names(thumbnails):
+    for key, names in (thumbnails or {}).items():
+        if isinstance(names, dict):
+            yield from names.values()
+
+
+def collect_garbage(storage=content_store, grace=GC_GRACE, dry_run=False):
+    """
+    Delete files under MANAGED_DIRS that no row references, plus temp files
+    left by interrupted uploads, once older than `grace`.
+    Returns (files kept, [deleted names], bytes freed).
+    """
+    refs = referenced_files()
+    cutoff = now() - grace
+    kept, deleted, freed = 0, [], 0
+    for directory in MANAGED_DIRS:
+        for name in _walk(storage, directory):
+            if refs[name] and not os.path.basename(name).startswith(TEMP_PREFIX):
+                kept += 1
+                continue
+            if storage.get_modified_time(name) > cutoff:
+                continue
+            freed += storage.size(name)
+            deleted.append(name)
+            if not dry_run:
+                storage.delete(name)
+    if deleted and not dry_run:
+        logger.info(f"Media GC removed {len(deleted)} files ({freed} bytes)")
+    return kept, deleted, freed
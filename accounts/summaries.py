@@ -0,0 +1,110 @@
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, Max, Q, Sum, Value, When
+from django.utils.timezone import now
+
+from .models import AccountSummary, BalanceShard, BankAccount, Transaction
+
+
+def record_activity(account_pk, credit=Decimal('0'), debit=Decimal('0'), credits=0, debits=0, at=None):
+    """
+    Add to an account's running totals. Call it inside the transaction that
+    moves the balance so the two can never disagree.
+    - credit / debit: amounts to add to total_credit / total_debit
+    - credits / debits: number of credit / debit rows written
+    - at: when the activity happened (defaults to now); never moves
+      last_transaction_at backwards
+    """
+    at = at or now()
+    changes = {
+        'total_credit': F('total_credit') + credit,
+        'total_debit': F('total_debit') + debit,
+        'credit_count': F('credit_count') + credits,
+        'debit_count': F('debit_count') + debits,
+        'last_transaction_at': Case(
+            When(last_transaction_at__gte=at, then=F('last_transaction_at')),
+            default=Value(at),
+        ),
+    }
+    if AccountSummary.objects.filter(account_id=account_pk).update(**changes):
+        return
+
+    # First activity for this account: create the row, unless a concurrent
+    # writer beat us to it, in which case fall back to the UPDATE.
+    try:
+        with transaction.atomic():
+            AccountSummary.objects.create(
+                account_id=account_pk,
+                total_credit=credit,
+                total_debit=debit,
+                credit_count=credits,
+                debit_count=debits,
+                last_transaction_at=at,
+            )
+    except IntegrityError:
+        AccountSummary.objects.filter(account_id=account_pk).update(**changes)
+
+
+def get_summary(account):
+    """
+    Totals for the history page. A single indexed lookup, plus one aggregate
+    over the shard rows for sharded accounts.
+    """
+    summary = AccountSummary.objects.filter(account=account).first() or AccountSummary(account=account)
+    if account.balance_shards:
+        from .sharding import pending_shard_totals
+
+        pending = pending_shard_totals(account)
+        summary.total_credit += pending['credit_total']
+        summary.credit_count += pending['credit_count']
+        if pending['last_credit_at'] and (
+            not summary.last_transaction_at or pending['last_credit_at'] > summary.last_transaction_at
+        ):
+            summary.last_transaction_at = pending['last_credit_at']
+    return summary
+
+
+def rebuild_summaries(account_pks=None, chunk_size=500):
+    """
+    Recompute summaries from the Transaction ledger.
+    Each chunk of accounts is locked while it is recomputed, so writers that
+    arrive meanwhile wait and then apply on top of the fresh totals.
+    Returns the number of accounts rebuilt.
+    """
+    accounts = BankAccount.objects.order_by('pk')
+    if account_pks is not None:
+        accounts = accounts.filter(pk__in=account_pks)
+    pks = list(accounts.values_list('pk', flat=True))
+
+    for start in range(0, len(pks), chunk_size):
+        chunk = pks[start:start + chunk_size]
+        with transaction.atomic():
+            list(BankAccount.objects.select_for_update().filter(pk__in=chunk).order_by('pk').values_list('pk'))
+            # Sharded credits don't touch the account row, so hold their shards too.
+            list(BalanceShard.objects.select_for_update().filter(account__in=chunk).order_by('account', 'index').values_list('pk'))
+            totals = {
+                row['account']: row
+                for row in Transaction.objects.filter(account__in=chunk).values('account').annotate(
+                    total_credit=Sum('amount', filter=Q(type='credit')),
+                    total_debit=Sum('amount', filter=Q(type='debit')),
+                    credit_count=Count('id', filter=Q(type='credit')),
+                    debit_count=Count('id', filter=Q(type='debit')),
+                    last_transaction_at=Max('date'),
+                ).order_by()
+            }
+            AccountSummary.objects.filter(account__in=chunk).delete()
+            AccountSummary.objects.bulk_create([
+                AccountSummary(
+                    account_id=pk,
+                    total_credit=totals.get(pk, {}).get('total_credit') or 0,
+                    total_debit=totals.get(pk, {}).get('total_debit') or 0,
+                    credit_count=totals.get(pk, {}).get('credit_count') or 0,
+                    debit_count=totals.get(pk, {}).get('debit_count') or 0,
+                    last_transaction_at=totals.get(pk, {}).get('last_transaction_at'),
+                )
+                for pk in chunk
+            ])
+            # The ledger already includes sharded credits; don't count them twice.
+            BalanceShard.objects.filter(account__in=chunk).update(credit_total=0, credit_count=0, last_credit_at=None)
+    return len(pks)
@@ -0,0 +1,18 @@
+from django import template
+
+from accounts.thumbnails import srcset, thumbnail_url
+
+
+register = template.Library()
+
+
+@register.simple_tag
+def photo_srcset(obj, fmt='webp'):
+    """srcset of obj.photo's thumbnails in one format ('' before they exist)."""
+    return srcset(obj.photo, obj.photo_thumbnails, fmt)
+
+
+@register.simple_tag
+def photo_src(obj, width):
+    """Fallback src: the JPEG thumbnail for `width` px, or the original upload."""
+    return thumbnail_url(obj.photo, obj.photo_thumbnails, width)
@@ -1,7 +1,47 @@
-from django.test import TestCase
-from accounts.models import User, BankAccount, Transaction
+from django.test import TestCase, override_settings
+from django.contrib.messages import get_messages
+from accounts.models import User, BankAccount, Transaction, IdempotencyKey, Message, AccountSummary, BalanceShard, OutboundEmail, AuditLog, CardRequest
 from accounts.forms import UserRegistrationForm
 from django.urls import reverse
+from django.test.utils import CaptureQueriesContext
+from django.core.exceptions import ValidationError
+from django.db import OperationalError, connection, transaction
+from decimal import Decimal
+from unittest.mock import patch
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.auth.hashers import make_password
+import asyncio
+import csv
+import json
+from datetime import timedelta
+from io import BytesIO, StringIO
+import os
+import tempfile
+import shutil
+from PIL import Image
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core import mail
+from django.utils import timezone
+from accounts.transfers import transfer, run_with_retry, credit, debit, batch_transfer, lock_accounts, _credit_account
+from accounts.utils import process_transaction
+from accounts.pagination import keyset_page, EstimatedCountPaginator
+from accounts.sharding import collapse_shards, enable_sharding, disable_sharding
+from accounts.summaries import get_summary
+from accounts.outbox import queue_email, drain, MAX_ATTEMPTS
+from accounts.events import broker
+from accounts.unread import rebuild_unread_counts, unread_count
+from django.core.cache import cache
+from accounts.admin import CONVERSATION_WINDOW
+from accounts.inbox import inbox_page, support_threads
+from accounts.media import may_access
+from accounts import lookup as lookup_module
+from accounts.lookup import LRUCache, RATE_LIMIT, RateLimiter, recipients
+from accounts.thumbnails import CHAT_WIDTHS
+from accounts.storage import collect_garbage, content_store, is_content_addressed
+from accounts.numbering import BLOCK_SIZE, allocator, is_valid_account_number, luhn_check_digit, with_check_digit
+from asgiref.sync import sync_to_async
 
 
 class UserModelTestCase(TestCase):
@@ -213,4 +253,1448 @@ class TransactionTestCase(TestCase):
             type="debit"
         )
         self.assertEqual(transaction.amount, 200.0)
-        self.assertEqual(transaction.type, "debit")
\ No newline at end of file
+        self.assertEqual(transaction.type, "debit")
+
+def create_customer(username, balance=0, **extra):
+    user = User.objects.create_user(
+        username=username,
+        email=f"{username}@example.com",
+        password="securepassword123",
+        first_name=username.title(),
+        last_name="User",
+        phone_number="1234567890",
+        gender="Male",
+        street="123 Test Street",
+        zip_code="12345",
+        country="Testland",
+        state="Teststate",
+        city="Testcity",
+        **extra
+    )
+    account = BankAccount.objects.create(user=user, account_type="Savings", balance=balance)
+    return user, account
+
+
+class TransferEngineTestCase(TestCase):
+    def setUp(self):
+        self.alice, self.alice_account = create_customer("alice", balance=Decimal("500.00"))
+        self.bob, self.bob_account = create_customer("bob", balance=Decimal("100.00"))
+
+    def test_transfer_moves_funds_and_records_both_sides(self):
+        transfer(self.alice_account, self.bob_account, Decimal("150.00"), "Rent")
+        self.alice_account.refresh_from_db()
+        self.bob_account.refresh_from_db()
+        self.assertEqual(self.alice_account.balance, Decimal("350.00"))
+        self.assertEqual(self.bob_account.balance, Decimal("250.00"))
+        self.assertEqual(Transaction.objects.filter(account=self.alice_account, type='debit').count(), 1)
+        self.assertEqual(Transaction.objects.filter(account=self.bob_account, type='credit').count(), 1)
+
+    def test_insufficient_funds_leaves_balances_untouched(self):
+        with self.assertRaises(ValidationError):
+            transfer(self.bob_account, self.alice_account, Decimal("1000.00"), "Too much")
+        self.bob_account.refresh_from_db()
+        self.assertEqual(self.bob_account.balance, Decimal("100.00"))
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_self_transfer_rejected(self):
+        with self.assertRaises(ValidationError):
+            transfer(self.alice_account, self.alice_account, Decimal("1.00"), "Self")
+
+    def test_deadlock_is_retried(self):
+        calls = []
+
+        def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise OperationalError("deadlock detected")
+            return "ok"
+
+        with patch("accounts.transfers.connection") as conn, patch("accounts.transfers.time.sleep"):
+            conn.in_atomic_block = False
+            self.assertEqual(run_with_retry(flaky), "ok")
+        self.assertEqual(len(calls), 3)
+
+    def test_non_transient_error_is_not_retried(self):
+        calls = []
+
+        def broken():
+            calls.append(1)
+            raise OperationalError("no such table")
+
+        with patch("accounts.transfers.connection") as conn:
+            conn.in_atomic_block = False
+            with self.assertRaises(OperationalError):
+                run_with_retry(broken)
+        self.assertEqual(len(calls), 1)
+
+    def test_process_transaction_accepts_float_amounts(self):
+        process_transaction(self.bob_account, 25.5, 'credit', 'Top-up')
+        self.bob_account.refresh_from_db()
+        self.assertEqual(self.bob_account.balance, Decimal("125.50"))
+
+
+class BalanceUpdateTestCase(TestCase):
+    def setUp(self):
+        self.user, self.account = create_customer("carol", balance=Decimal("50.00"))
+
+    def test_debit_is_a_single_conditional_update(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(debit(self.account.pk, Decimal("20.00")))
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal("30.00"))
+
+    def test_debit_refused_when_balance_too_low(self):
+        self.assertFalse(debit(self.account.pk, Decimal("50.01")))
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal("50.00"))
+
+    def test_credit_does_not_rewrite_other_columns(self):
+        BankAccount.objects.filter(pk=self.account.pk).update(status='Frozen')
+        # self.account still thinks it is Active; a full save() would revert the freeze.
+        self.assertTrue(credit(self.account.pk, Decimal("5.00")))
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.status, 'Frozen')
+        self.assertEqual(self.account.balance, Decimal("55.00"))
+
+    def test_transfer_to_inactive_account_rolls_back(self):
+        _, frozen = create_customer("dave", balance=Decimal("0.00"))
+        BankAccount.objects.filter(pk=frozen.pk).update(status='Frozen')
+        with self.assertRaisesMessage(ValidationError, "Recipient’s account is not active."):
+            transfer(self.account, frozen, Decimal("10.00"), "Gift")
+        self.account.refresh_from_db()
+        frozen.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal("50.00"))
+        self.assertEqual(frozen.balance, Decimal("0.00"))
+
+
+class BatchTransferTestCase(TestCase):
+    def setUp(self):
+        self.payer, self.payer_account = create_customer("payroll", balance=Decimal("1000.00"))
+        BankAccount.objects.filter(pk=self.payer_account.pk).update(transaction_pin=make_password("123456"))
+        self.payer_account.refresh_from_db()
+        self.staff = [create_customer(f"staff{i}")[1] for i in range(3)]
+
+    def items(self, *amounts):
+        return [
+            {'account_number': account.account_number, 'amount': amount, 'description': 'Salary'}
+            for account, amount in zip(self.staff, amounts)
+        ]
+
+    def test_partial_batch_applies_good_items(self):
+        items = self.items("100.00", "200.00") + [{'account_number': '000000000000', 'amount': '5.00'}]
+        results, applied = batch_transfer(self.payer_account, items)
+        self.assertEqual(applied, 2)
+        self.assertEqual([r['status'] for r in results], ['ok', 'ok', 'failed'])
+        self.payer_account.refresh_from_db()
+        self.assertEqual(self.payer_account.balance, Decimal("700.00"))
+        self.assertEqual(Transaction.objects.count(), 4)
+
+    def test_all_or_nothing_writes_nothing_on_failure(self):
+        items = self.items("600.00", "600.00")
+        results, applied = batch_transfer(self.payer_account, items, all_or_nothing=True)
+        self.assertEqual(applied, 0)
+        self.assertEqual([r['status'] for r in results], ['not_applied', 'failed'])
+        self.payer_account.refresh_from_db()
+        self.assertEqual(self.payer_account.balance, Decimal("1000.00"))
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_endpoint_checks_pin_once(self):
+        self.client.force_login(self.payer)
+        url = reverse('batch_transfer_money')
+        body = {'pin': '000000', 'transfers': self.items("1.00")}
+        response = self.client.post(url, json.dumps(body), content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+        body['pin'] = '123456'
+        body['transfers'] = self.items("1.00", "2.00", "3.00")
+        response = self.client.post(url, json.dumps(body), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['applied'], 3)
+        self.staff[2].refresh_from_db()
+        self.assertEqual(self.staff[2].balance, Decimal("3.00"))
+
+
+class IdempotencyTestCase(TestCase):
+    def setUp(self):
+        self.user, self.account = create_customer("erin", balance=Decimal("100.00"))
+        self.client.force_login(self.user)
+
+    def test_replayed_top_up_does_not_credit_twice(self):
+        data = {'amount': '25.00', 'idempotency_key': 'abc123'}
+        first = self.client.post(reverse('top_up'), data)
+        second = self.client.post(reverse('top_up'), data)
+        self.assertEqual(first.status_code, 302)
+        self.assertEqual(second.status_code, 302)
+        self.assertEqual(second['Location'], first['Location'])
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal("125.00"))
+        self.assertEqual(Transaction.objects.filter(account=self.account).count(), 1)
+
+    def test_header_key_and_different_keys(self):
+        self.client.post(reverse('deposit'), {'amount': '10.00'}, HTTP_IDEMPOTENCY_KEY='k1')
+        self.client.post(reverse('deposit'), {'amount': '10.00'}, HTTP_IDEMPOTENCY_KEY='k1')
+        self.client.post(reverse('deposit'), {'amount': '10.00'}, HTTP_IDEMPOTENCY_KEY='k2')
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal("120.00"))
+
+    def test_in_flight_key_conflicts(self):
+        IdempotencyKey.objects.create(user=self.user, key='busy', endpoint='top_up',
+                                      expires_at=timezone.now() + timedelta(minutes=5))
+        response = self.client.post(reverse('top_up'), {'amount': '5.00', 'idempotency_key': 'busy'})
+        self.assertEqual(response.status_code, 409)
+
+    def test_abandoned_claim_is_taken_over_after_lease(self):
+        IdempotencyKey.objects.create(user=self.user, key='crashed', endpoint='top_up',
+                                      claimed_at=timezone.now() - timedelta(minutes=5),
+                                      expires_at=timezone.now() + timedelta(hours=1))
+        response = self.client.post(reverse('top_up'), {'amount': '5.00', 'idempotency_key': 'crashed'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(IdempotencyKey.objects.get(key='crashed').status_code, 302)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal("105.00"))
+
+    def test_only_page_replays_flash_a_message(self):
+        expires = timezone.now() + timedelta(hours=1)
+        IdempotencyKey.objects.create(user=self.user, key='json', endpoint='batch_transfer_money', status_code=200,
+                                      content_type='application/json', body='{"applied": 1}', expires_at=expires)
+        response = self.client.post(reverse('batch_transfer_money'), '{}', content_type='application/json',
+                                    HTTP_IDEMPOTENCY_KEY='json')
+        self.assertEqual(response.json(), {'applied': 1})
+        self.assertEqual(list(get_messages(response.wsgi_request)), [])
+
+        IdempotencyKey.objects.create(user=self.user, key='page', endpoint='top_up', status_code=302,
+                                      location='/dashboard/', expires_at=expires)
+        response = self.client.post(reverse('top_up'), {'amount': '5.00', 'idempotency_key': 'page'})
+        self.assertEqual([str(m) for m in get_messages(response.wsgi_request)], ["This request has already been processed."])
+
+    def test_expired_keys_are_purged_and_reusable(self):
+        IdempotencyKey.objects.create(user=self.user, key='old', endpoint='top_up', status_code=302,
+                                      location='/dashboard/', expires_at=timezone.now() - timedelta(seconds=1))
+        self.client.post(reverse('top_up'), {'amount': '5.00', 'idempotency_key': 'old'})
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal("105.00"))
+
+        IdempotencyKey.objects.filter(key='old').update(expires_at=timezone.now() - timedelta(seconds=1))
+        call_command('purge_idempotency_keys', stdout=StringIO())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class QueryPlanTestCase(TestCase):
+    """
+    Fails if a hot query stops using its index (e.g. someone drops it or
+    changes the filter so it no longer matches).
+    """
+
+    def setUp(self):
+        self.user, self.account = create_customer("frank")
+
+    def assertUsesIndex(self, queryset, *index_names):
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                # Tiny test tables would otherwise always get a sequential scan.
+                with connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL enable_seqscan = off")
+            plan = queryset.explain()
+        self.assertTrue(
+            any(name in plan for name in index_names),
+            f"Expected one of {index_names} in plan:\n{plan}"
+        )
+
+    def test_transaction_history_uses_account_date_index(self):
+        self.assertUsesIndex(
+            Transaction.objects.filter(account=self.account).order_by('-date', '-id'),
+            'txn_account_date_idx'
+        )
+
+    def test_unread_badge_uses_unread_index(self):
+        self.assertUsesIndex(
+            # .count() drops the default ordering, so explain the unordered query.
+            Message.objects.filter(user=self.user, sender='Admin', is_read=False).order_by(),
+            'msg_unread_admin_idx', 'msg_user_sender_read_idx'
+        )
+
+    def test_waiting_inbox_uses_thread_index(self):
+        self.assertUsesIndex(
+            support_threads(waiting_only=True).order_by('-last_message_at', '-pk'),
+            'user_waiting_thread_idx'
+        )
+
+    def test_chat_fetch_uses_user_created_index(self):
+        self.assertUsesIndex(
+            Message.objects.filter(user=self.user, created_at__gt=timezone.now()).order_by('created_at'),
+            'msg_user_created_idx'
+        )
+
+
+class TransactionHistoryPaginationTestCase(TestCase):
+    def setUp(self):
+        self.user, self.account = create_customer("gina")
+        same_moment = timezone.now()
+        Transaction.objects.bulk_create([
+            Transaction(account=self.account, amount=Decimal(i + 1), type='credit', description=f"T{i}")
+            for i in range(7)
+        ])
+        # Several rows sharing a timestamp must still page without gaps or repeats.
+        Transaction.objects.filter(account=self.account).update(date=same_moment)
+
+    def test_keyset_pages_cover_every_row_once(self):
+        seen = []
+        cursor = None
+        while True:
+            items, cursor = keyset_page(Transaction.objects.filter(account=self.account), cursor, page_size=3)
+            seen.extend(t.pk for t in items)
+            if not cursor:
+                break
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(len(set(seen)), 7)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+
+    def test_history_view_links_to_older_page(self):
+        self.client.force_login(self.user)
+        with patch("accounts.views.HISTORY_PAGE_SIZE", 5):
+            first = self.client.get(reverse('transaction_history'))
+            self.assertEqual(len(first.context['transactions']), 5)
+            cursor = first.context['next_cursor']
+            self.assertContains(first, f"?before={cursor}")
+            second = self.client.get(reverse('transaction_history'), {'before': cursor})
+        self.assertEqual(len(second.context['transactions']), 2)
+        self.assertIsNone(second.context['next_cursor'])
+
+    def test_malformed_cursor_falls_back_to_first_page(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('transaction_history'), {'before': '!!not-a-cursor'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['transactions']), 7)
+
+
+class AccountSummaryTestCase(TestCase):
+    def setUp(self):
+        self.user, self.account = create_customer("hank", balance=Decimal("100.00"))
+        _, self.other = create_customer("ivy", balance=Decimal("100.00"))
+
+    def test_summary_tracks_every_balance_change(self):
+        process_transaction(self.account, 40, 'credit', 'Top-up')
+        transfer(self.account, self.other, Decimal("30.00"), "Lunch")
+        batch_transfer(self.account, [{'account_number': self.other.account_number, 'amount': '5.00'}] * 2)
+
+        summary = AccountSummary.objects.get(account=self.account)
+        self.assertEqual(summary.total_credit, Decimal("40.00"))
+        self.assertEqual(summary.total_debit, Decimal("40.00"))
+        self.assertEqual((summary.credit_count, summary.debit_count), (1, 3))
+        other = AccountSummary.objects.get(account=self.other)
+        self.assertEqual((other.total_credit, other.credit_count), (Decimal("40.00"), 3))
+
+    def test_history_view_reads_totals_without_aggregating(self):
+        process_transaction(self.account, 12, 'credit', 'Top-up')
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('transaction_history'))
+        self.assertEqual(response.context['total_credit'], Decimal("12.00"))
+        self.assertEqual(response.context['total_debit'], 0)
+
+    def test_rebuild_recomputes_from_ledger(self):
+        process_transaction(self.account, 10, 'credit', 'Top-up')
+        Transaction.objects.create(account=self.account, amount=Decimal("3.00"), type='debit', description="Manual fix")
+        AccountSummary.objects.filter(account=self.account).update(total_credit=999)
+
+        call_command('rebuild_account_summaries', stdout=StringIO())
+
+        summary = AccountSummary.objects.get(account=self.account)
+        self.assertEqual(summary.total_credit, Decimal("10.00"))
+        self.assertEqual(summary.total_debit, Decimal("3.00"))
+        self.assertTrue(AccountSummary.objects.filter(account=self.other, credit_count=0).exists())
+
+
+class StatementExportTestCase(TestCase):
+    def setUp(self):
+        self.user, self.account = create_customer("jack", balance=Decimal("0.00"))
+        process_transaction(self.account, 100, 'credit', 'Salary')
+        process_transaction(self.account, 30, 'debit', 'Groceries & <stuff>')
+        self.client.force_login(self.user)
+
+    def test_csv_export_streams_signed_amounts(self):
+        response = self.client.get(reverse('export_statement'), {'format': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "Date,Description,Type,Amount,Currency,Reference")
+        self.assertIn(",Salary,credit,100.00,USD,", lines[1])
+        self.assertIn("debit,-30.00,USD,", lines[2])
+
+    def test_csv_neutralises_formulas(self):
+        process_transaction(self.account, 1, 'credit', '=HYPERLINK("http://evil.example")')
+        process_transaction(self.account, 1, 'credit', '-2+3')
+        response = self.client.get(reverse('export_statement'), {'format': 'csv'})
+        rows = list(csv.reader(StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEqual([row[1] for row in rows[3:]], ["'=HYPERLINK(\"http://evil.example\")", "'-2+3"])
+        self.assertEqual(rows[1][1], "Salary")
+
+    async def test_asgi_export_streams_from_async_generator(self):
+        await self.async_client.aforce_login(self.user)
+        for export_format, marker in (('csv', ',Salary,credit,100.00,USD,'), ('ofx', '<BALAMT>70.00</BALAMT>')):
+            response = await self.async_client.get(reverse('export_statement'), {'format': export_format})
+            self.assertTrue(response.is_async)
+            body = b"".join([chunk async for chunk in response.streaming_content]).decode()
+            self.assertIn(marker, body)
+
+    def test_ofx_export_is_escaped(self):
+        response = self.client.get(reverse('export_statement'), {'format': 'ofx'})
+        body = b"".join(response.streaming_content).decode()
+        self.assertEqual(response['Content-Type'], 'application/x-ofx')
+        self.assertEqual(body.count("<STMTTRN>"), 2)
+        self.assertIn("<TRNAMT>-30.00</TRNAMT>", body)
+        self.assertIn("Groceries &amp; &lt;stuff&gt;", body)
+
+    def test_date_range_filters_and_validates(self):
+        tomorrow = (timezone.localdate() + timedelta(days=1)).isoformat()
+        response = self.client.get(reverse('export_statement'), {'start': tomorrow, 'end': tomorrow})
+        self.assertEqual(len(b"".join(response.streaming_content).decode().splitlines()), 1)
+        response = self.client.get(reverse('export_statement'), {'start': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+
+class BalanceShardingTestCase(TestCase):
+    def setUp(self):
+        self.user, self.hot = create_customer("merchant", balance=Decimal("10.00"))
+        enable_sharding(self.hot, 4)
+        _, self.payer = create_customer("payer", balance=Decimal("100.00"))
+
+    def test_credits_land_on_shards_and_total_includes_them(self):
+        for _ in range(5):
+            process_transaction(self.hot, 2, 'credit', 'Sale')
+        transfer(self.payer, self.hot, Decimal("5.00"), "Order")
+
+        self.hot.refresh_from_db()
+        self.assertEqual(self.hot.balance, Decimal("10.00"))
+        self.assertEqual(self.hot.total_balance, Decimal("25.00"))
+        self.assertEqual(BalanceShard.objects.filter(account=self.hot).count(), 4)
+        summary = get_summary(self.hot)
+        self.assertEqual((summary.total_credit, summary.credit_count), (Decimal("15.00"), 6))
+
+    def test_debit_folds_shards_when_main_balance_is_short(self):
+        process_transaction(self.hot, 30, 'credit', 'Sale')
+        transfer(self.hot, self.payer, Decimal("35.00"), "Refund")
+
+        self.hot.refresh_from_db()
+        self.assertEqual(self.hot.total_balance, Decimal("5.00"))
+        self.assertEqual(self.hot.balance, Decimal("5.00"))
+        self.assertFalse(BalanceShard.objects.filter(account=self.hot).exclude(balance=0).exists())
+        summary = get_summary(self.hot)
+        self.assertEqual((summary.total_credit, summary.total_debit), (Decimal("30.00"), Decimal("35.00")))
+
+    def test_collapse_locks_account_before_shards(self):
+        process_transaction(self.hot, 5, 'credit', 'Sale')
+        with CaptureQueriesContext(connection) as ctx, transaction.atomic():
+            collapse_shards(self.hot.pk)
+        tables = [q['sql'].split(' FROM ')[1].split()[0] for q in ctx.captured_queries if q['sql'].startswith('SELECT')]
+        self.assertEqual(tables[:2], ['"accounts_bankaccount"', '"accounts_balanceshard"'])
+
+    def test_batch_locks_shards_before_higher_accounts(self):
+        # hot has the lower pk: a single transfer payer -> hot credits a hot
+        # shard before touching payer's row, so the batch must too.
+        self.assertLess(self.hot.pk, self.payer.pk)
+        with CaptureQueriesContext(connection) as ctx, transaction.atomic():
+            lock_accounts(self.payer.pk, self.hot.pk)
+        tables = [q['sql'].split(' FROM ')[1].split()[0] for q in ctx.captured_queries if q['sql'].startswith('SELECT')]
+        # After the read that finds the sharded accounts: hot's row, hot's shards, then payer's row.
+        self.assertEqual(tables[1:], ['"accounts_bankaccount"', '"accounts_balanceshard"', '"accounts_bankaccount"'])
+
+        results, applied = batch_transfer(self.payer, [{'account_number': self.hot.account_number, 'amount': '5.00'}])
+        self.assertEqual(applied, 1)
+        self.hot.refresh_from_db()
+        self.assertEqual(self.hot.total_balance, Decimal("15.00"))
+
+    def test_debit_beyond_total_is_refused(self):
+        process_transaction(self.hot, 5, 'credit', 'Sale')
+        with self.assertRaisesMessage(ValidationError, "Insufficient funds."):
+            transfer(self.hot, self.payer, Decimal("15.01"), "Too much")
+        self.hot.refresh_from_db()
+        self.assertEqual(self.hot.total_balance, Decimal("15.00"))
+
+    def test_disable_sharding_folds_everything_back(self):
+        process_transaction(self.hot, 7, 'credit', 'Sale')
+        disable_sharding(self.hot)
+        self.hot.refresh_from_db()
+        self.assertEqual((self.hot.balance, self.hot.balance_shards), (Decimal("17.00"), 0))
+        self.assertFalse(BalanceShard.objects.exists())
+        self.assertEqual(AccountSummary.objects.get(account=self.hot).credit_count, 1)
+
+
+class EmailOutboxTestCase(TestCase):
+    def setUp(self):
+        self.user, self.account = create_customer("kate", balance=Decimal("0.00"))
+        self.client.force_login(self.user)
+
+    def test_top_up_queues_instead_of_sending(self):
+        self.client.post(reverse('top_up'), {'amount': '20.00'})
+        self.assertEqual(len(mail.outbox), 0)
+        queued = OutboundEmail.objects.get()
+        self.assertEqual((queued.subject, queued.recipients, queued.status), ("Top-Up Successful", "kate@example.com", 'pending'))
+
+        call_command('send_outbox', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["kate@example.com"])
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, 'sent')
+
+    def test_top_up_retried_after_deadlock_credits_and_queues_once(self):
+        calls = []
+
+        def deadlock_once(*args, **kwargs):
+            calls.append(1)
+            result = _credit_account(*args, **kwargs)
+            if len(calls) == 1:
+                raise OperationalError("deadlock detected")
+            return result
+
+        class OutsideTestCaseAtomic:
+            # Only atomic blocks opened by the code under test count, not TestCase's own.
+            @property
+            def in_atomic_block(self):
+                return any(not getattr(block, '_from_testcase', False) for block in connection.atomic_blocks)
+
+        with patch("accounts.transfers._credit_account", deadlock_once), \
+                patch("accounts.transfers.connection", OutsideTestCaseAtomic()), patch("accounts.transfers.time.sleep"):
+            self.client.post(reverse('top_up'), {'amount': '20.00'})
+        self.assertEqual(len(calls), 2)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal("20.00"))
+        self.assertEqual(OutboundEmail.objects.count(), 1)
+
+    def test_rolled_back_transaction_sends_nothing(self):
+        with self.assertRaises(ValidationError):
+            with transaction.atomic():
+                queue_email("Hello", "Body", ["x@example.com"])
+                raise ValidationError("boom")
+        self.assertFalse(OutboundEmail.objects.exists())
+
+    def test_failures_are_retried_then_given_up(self):
+        email = queue_email("Hello", "Body", ["x@example.com"])
+        with patch("django.core.mail.backends.locmem.EmailBackend.send_messages", side_effect=OSError("smtp down")):
+            for _ in range(MAX_ATTEMPTS):
+                OutboundEmail.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now())
+                drain()
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('failed', MAX_ATTEMPTS))
+        self.assertIn("smtp down", email.last_error)
+
+    def test_backoff_defers_next_attempt(self):
+        email = queue_email("Hello", "Body", ["x@example.com"])
+        with patch("django.core.mail.backends.locmem.EmailBackend.send_messages", side_effect=OSError("smtp down")):
+            drain()
+        self.assertEqual(drain(), (0, 0))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('pending', 1))
+        self.assertGreater(email.next_attempt_at, timezone.now())
+
+
+    def test_crash_mid_batch_keeps_sent_emails_sent(self):
+        first = queue_email("One", "Body", ["a@example.com"])
+        second = queue_email("Two", "Body", ["b@example.com"])
+        real_send = mail.get_connection().__class__.send_messages
+        calls = []
+
+        def send_then_crash(backend, messages):
+            calls.append(messages[0].subject)
+            if len(calls) == 2:
+                raise SystemExit("worker killed")
+            return real_send(backend, messages)
+
+        with patch("django.core.mail.backends.locmem.EmailBackend.send_messages", send_then_crash):
+            with self.assertRaises(SystemExit):
+                drain()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.status, 'sent')
+        self.assertEqual((second.status, second.attempts), ('sending', 1))
+        self.assertEqual(drain(), (0, 0))  # still leased to the dead worker
+
+        OutboundEmail.objects.filter(pk=second.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(drain(), (1, 0))
+        self.assertEqual([m.subject for m in mail.outbox], ["One", "Two"])
+
+
+class ChatSyncTestCase(TestCase):
+    def setUp(self):
+        self.user, _ = create_customer("liam")
+        self.client.force_login(self.user)
+        self.first = Message.objects.create(user=self.user, sender='User', content="Hi")
+        self.reply = Message.objects.create(user=self.user, sender='Admin', content="Hello!")
+
+    def test_sync_returns_only_newer_messages_and_marks_them_read(self):
+        response = self.client.get(reverse('sync_messages'), {'after': self.first.id})
+        data = response.json()
+        self.assertEqual([m['id'] for m in data['messages']], [self.reply.id])
+        self.assertEqual(data['last_id'], self.reply.id)
+        self.reply.refresh_from_db()
+        self.assertTrue(self.reply.is_read)
+
+    def test_idle_poll_is_one_query_and_no_writes(self):
+        # Session + user lookups come from auth middleware; the view itself adds one read.
+        self.client.get(reverse('sync_messages'), {'after': self.reply.id})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('sync_messages'), {'after': self.reply.id})
+        self.assertEqual(response.json()['messages'], [])
+        message_queries = [q['sql'] for q in queries if 'accounts_message' in q['sql']]
+        self.assertEqual(len(message_queries), 1)
+        self.assertTrue(message_queries[0].lstrip().upper().startswith('SELECT'))
+
+    def test_fetch_messages_accepts_id_cursor(self):
+        response = self.client.get(reverse('fetch_messages'), {'after_id': self.first.id})
+        self.assertEqual([m['id'] for m in response.json()['new_messages']], [self.reply.id])
+
+    def test_sync_uses_user_id_index(self):
+        plan = Message.objects.filter(user=self.user, id__gt=self.reply.id).order_by('id').explain()
+        self.assertIn('msg_user_id_idx', plan)
+
+
+class MessageStreamTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user, _ = create_customer("mia")
+        self.earlier = Message.objects.create(user=self.user, sender='Admin', content="Welcome")
+        rebuild_unread_counts([self.user.pk])
+
+    def post_reply(self, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Message.objects.create(user=self.user, sender='Admin', content=content)
+
+    async def read_event(self, stream):
+        return (await asyncio.wait_for(anext(stream), 5)).decode()
+
+    async def test_stream_pushes_new_messages_and_unread_count(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('message_stream'), {'after': self.earlier.id})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = response.streaming_content
+        try:
+            self.assertTrue((await self.read_event(stream)).startswith('retry:'))
+            self.assertIn('"count": 1', await self.read_event(stream))
+            self.assertTrue(broker.has_subscribers(self.user.pk))
+
+            reply = await sync_to_async(self.post_reply)("Your card is on its way")
+            event = await self.read_event(stream)
+            self.assertIn(f"id: {reply.id}\nevent: message", event)
+            self.assertIn("Your card is on its way", event)
+            self.assertIn('"count": 2', await self.read_event(stream))
+        finally:
+            await stream.aclose()
+
+    async def test_reconnect_replays_missed_messages(self):
+        missed = await Message.objects.acreate(user=self.user, sender='Admin', content="While you were away")
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(
+            reverse('message_stream'), headers={'Last-Event-ID': str(self.earlier.id)}
+        )
+        stream = response.streaming_content
+        try:
+            await self.read_event(stream)  # retry
+            await self.read_event(stream)  # unread
+            self.assertIn(f"id: {missed.id}\nevent: message", await self.read_event(stream))
+        finally:
+            await stream.aclose()
+
+    def test_wsgi_requests_fall_back_to_polling(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('message_stream'))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.get(reverse('unread_messages_count')).json()['unread_count'], 1)
+
+
+class UnreadCounterTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user, _ = create_customer("noah")
+        self.admin = User.objects.create_superuser("staff", "staff@example.com", "pw")
+        self.thread = Message.objects.create(user=self.user, sender='User', content="Where is my card?")
+
+    def reply_from_admin(self, text="On its way"):
+        self.client.force_login(self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse('admin:accounts_message_change', args=[self.thread.pk]),
+                {'_reply_action': '1', 'reply_content': text},
+            )
+        self.client.force_login(self.user)
+
+    def test_admin_reply_increments_and_chat_page_resets(self):
+        self.reply_from_admin()
+        self.reply_from_admin("Delivered tomorrow")
+        self.assertEqual(unread_count(self.user.pk), 2)
+        self.assertEqual(self.client.get(reverse('unread_messages_count')).json()['unread_count'], 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('user_messages'))
+        self.assertEqual(self.client.get(reverse('unread_messages_count')).json()['unread_count'], 0)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.unread_messages, 0)
+
+    def test_badge_poll_is_a_cache_hit(self):
+        self.reply_from_admin()
+        self.client.get(reverse('unread_messages_count'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('unread_messages_count'))
+        self.assertEqual(response.json()['unread_count'], 1)
+        # Only the auth middleware's session/user lookups; the count itself comes from the cache.
+        self.assertFalse([
+            q for q in queries
+            if 'accounts_message' in q['sql'] or q['sql'].startswith('SELECT "accounts_user"."unread_messages"')
+        ])
+        self.assertEqual(len(queries), 2)
+
+    def test_cache_miss_falls_back_to_database(self):
+        self.reply_from_admin()
+        cache.clear()
+        self.assertEqual(unread_count(self.user.pk), 1)
+
+    def test_fill_racing_a_commit_is_not_served(self):
+        real_add = cache.add
+
+        def reply_commits_first(key, *args, **kwargs):
+            # A reply commits between the reader's database read and its count fill.
+            if not key.startswith('unread:version:'):
+                with self.captureOnCommitCallbacks(execute=True):
+                    Message.objects.create(user=self.user, sender='Admin', content="Racing reply")
+            return real_add(key, *args, **kwargs)
+
+        with patch('accounts.unread.cache.add', side_effect=reply_commits_first):
+            self.assertEqual(unread_count(self.user.pk), 0)
+        self.assertEqual(unread_count(self.user.pk), 1)
+
+    def test_replies_created_anywhere_are_counted(self):
+        unread_count(self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            reply = Message.objects.create(user=self.user, sender='Admin', content="From a script")
+            Message.objects.create(user=self.user, sender='Admin', content="Already read", is_read=True)
+        self.assertEqual(unread_count(self.user.pk), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            reply.delete()
+        self.assertEqual(unread_count(self.user.pk), 0)
+
+    def test_rebuild_repairs_drift(self):
+        Message.objects.create(user=self.user, sender='Admin', content="Sent outside the admin")
+        User.objects.filter(pk=self.user.pk).update(unread_messages=7)
+        out = StringIO()
+        call_command('rebuild_unread_counts', user=[self.user.pk], stdout=out)
+        self.assertIn("1 users", out.getvalue())
+        self.assertEqual(unread_count(self.user.pk), 1)
+
+
+class AdminConversationTestCase(TestCase):
+    def setUp(self):
+        self.user, _ = create_customer("olivia")
+        self.admin = User.objects.create_superuser("staff", "staff@example.com", "pw")
+        self.client.force_login(self.admin)
+        self.thread = Message.objects.create(user=self.user, sender='User', content="<b>Hello</b>")
+
+    def add_messages(self, count):
+        Message.objects.bulk_create([
+            Message(user=self.user, sender='Admin' if i % 2 else 'User', content=f"message {i}")
+            for i in range(count)
+        ])
+
+    def change_page_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:accounts_message_change', args=[self.thread.pk]))
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_query_count_does_not_grow_with_thread_length(self):
+        self.add_messages(5)
+        _, short_thread = self.change_page_queries()
+        self.add_messages(CONVERSATION_WINDOW * 3)
+        response, long_thread = self.change_page_queries()
+        self.assertEqual(short_thread, long_thread)
+        self.assertContains(response, "Load earlier messages")
+        self.assertContains(response, 'class="msg ', count=CONVERSATION_WINDOW)
+
+    def test_content_is_escaped(self):
+        response, _ = self.change_page_queries()
+        self.assertContains(response, "&lt;b&gt;Hello&lt;/b&gt;")
+        self.assertNotContains(response, "Load earlier messages")
+
+    def test_load_earlier_returns_previous_window(self):
+        self.add_messages(CONVERSATION_WINDOW + 10)
+        oldest_shown = Message.objects.filter(user=self.user).order_by('-id')[CONVERSATION_WINDOW - 1]
+        response = self.client.get(
+            reverse('admin:accounts_message_conversation', args=[self.thread.pk]), {'before': oldest_shown.id}
+        )
+        self.assertEqual(response['X-Has-Earlier'], '0')
+        self.assertContains(response, 'class="msg ', count=11)
+
+
+class SupportInboxTestCase(TestCase):
+    def setUp(self):
+        self.waiting, _ = create_customer("paul")
+        self.answered, _ = create_customer("quinn")
+        create_customer("silent")  # no messages: not a thread
+        Message.objects.create(user=self.waiting, sender='User', content="First question")
+        Message.objects.create(user=self.waiting, sender='Admin', content="Answer")
+        Message.objects.create(user=self.waiting, sender='User', content="Follow-up")
+        Message.objects.create(user=self.waiting, sender='User', content="Anyone there?")
+        Message.objects.create(user=self.answered, sender='User', content="Thanks")
+        self.last = Message.objects.create(user=self.answered, sender='Admin', content="You're welcome")
+
+    def test_one_row_per_thread_with_unanswered_counts(self):
+        with self.assertNumQueries(1):
+            threads, next_cursor = inbox_page()
+        self.assertIsNone(next_cursor)
+        rows = {t.username: t for t in threads}
+        self.assertEqual(list(rows), ["quinn", "paul"])
+        self.assertEqual(rows["paul"].unanswered, 2)
+        self.assertEqual(rows["paul"].last_preview, "Anyone there?")
+        self.assertEqual(rows["quinn"].unanswered, 0)
+        self.assertEqual(rows["quinn"].last_message_id, self.last.id)
+
+    def test_waiting_filter_and_pagination(self):
+        threads, _ = inbox_page(waiting_only=True)
+        self.assertEqual([t.username for t in threads], ["paul"])
+
+        first, cursor = inbox_page(page_size=1)
+        second, end = inbox_page(cursor, page_size=1)
+        self.assertEqual([t.username for t in first + second], ["quinn", "paul"])
+        self.assertIsNone(end)
+
+    def test_thread_summary_follows_writes(self):
+        self.waiting.refresh_from_db()
+        self.assertEqual(self.waiting.unanswered_messages, 2)
+        reply = Message.objects.create(user=self.waiting, sender='Admin', content="Sorry for the wait")
+        self.waiting.refresh_from_db()
+        self.assertEqual((self.waiting.last_message_id, self.waiting.unanswered_messages), (reply.id, 0))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reply.delete()
+        self.waiting.refresh_from_db()
+        self.assertEqual(self.waiting.unanswered_messages, 2)
+        self.assertEqual(self.waiting.last_message.content, "Anyone there?")
+
+    def test_bulk_deletes_rebuild_once_per_transaction(self):
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                Message.objects.filter(user=self.waiting, sender='User').delete()
+                self.answered.delete()
+        self.assertEqual(len([c for c in callbacks if hasattr(c, 'user_ids')]), 1)
+        user_updates = [q for q in queries if q['sql'].startswith('UPDATE "accounts_user"')]
+        # One thread rebuild and one unread recount, only for the surviving user.
+        self.assertEqual(len([q for q in user_updates if 'unanswered_messages' in q['sql']]), 1)
+        self.waiting.refresh_from_db()
+        self.assertEqual((self.waiting.unanswered_messages, self.waiting.last_message.sender), (0, 'Admin'))
+
+    def test_inbox_admin_view(self):
+        self.client.force_login(User.objects.create_superuser("staff", "staff@example.com", "pw"))
+        response = self.client.get(reverse('admin:accounts_message_inbox'), {'waiting': '1'})
+        self.assertContains(response, "Anyone there?")
+        self.assertNotContains(response, "You&#x27;re welcome")
+        self.assertContains(self.client.get(reverse('admin:accounts_message_changelist')), "Support inbox")
+
+
+class AdminBulkActionTestCase(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser("staff", "staff@example.com", "pw")
+        self.client.force_login(self.admin)
+        self.accounts = [create_customer(f"bulk{i}")[1] for i in range(5)]
+        BankAccount.objects.filter(pk=self.accounts[4].pk).update(status='Closed')
+
+    def run_action(self, url_name, action, pks):
+        return self.client.post(reverse(url_name), {'action': action, '_selected_action': pks}, follow=True)
+
+    def test_freeze_is_one_update_and_one_audit_record(self):
+        users = [account.user_id for account in self.accounts]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.run_action('admin:accounts_user_changelist', 'freeze_bank_accounts', users)
+        self.assertContains(response, "4 bank accounts have been frozen.")
+        updates = [q for q in queries if q['sql'].startswith('UPDATE "accounts_bankaccount"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(
+            list(BankAccount.objects.order_by('pk').values_list('status', flat=True)),
+            ['Frozen'] * 4 + ['Closed'],
+        )
+        log = AuditLog.objects.get()
+        self.assertEqual((log.action, log.count, log.actor), ('freeze_accounts', 4, self.admin))
+        self.assertEqual(log.object_ids, [account.pk for account in self.accounts[:4]])
+
+    def test_close_and_reactivate_from_account_changelist(self):
+        pks = [account.pk for account in self.accounts]
+        self.run_action('admin:accounts_bankaccount_changelist', 'close_bank_accounts', pks)
+        self.assertFalse(BankAccount.objects.exclude(status='Closed').exists())
+        self.run_action('admin:accounts_bankaccount_changelist', 'reactivate_bank_accounts', pks[:2])
+        self.assertEqual(BankAccount.objects.filter(status='Active').count(), 2)
+        self.assertEqual(list(AuditLog.objects.order_by('pk').values_list('count', flat=True)), [4, 2])
+
+    def test_approve_card_requests(self):
+        pending = CardRequest.objects.create(user=self.accounts[0].user)
+        from_dashboard = CardRequest.objects.create(user=self.accounts[2].user, status='pending')
+        rejected = CardRequest.objects.create(user=self.accounts[1].user, status='Rejected')
+        self.run_action(
+            'admin:accounts_cardrequest_changelist', 'approve_card_requests',
+            [pending.pk, from_dashboard.pk, rejected.pk],
+        )
+        statuses = dict(CardRequest.objects.values_list('pk', 'status'))
+        self.assertEqual(
+            [statuses[pending.pk], statuses[from_dashboard.pk], statuses[rejected.pk]],
+            ['Approved', 'Approved', 'Rejected'],
+        )
+        self.assertEqual(AuditLog.objects.get().object_ids, [pending.pk, from_dashboard.pk])
+
+
+class AdminChangelistPerformanceTestCase(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("staff", "staff@example.com", "pw"))
+
+    def add_rows(self, count):
+        for i in range(count):
+            user, account = create_customer(f"row{BankAccount.objects.count()}")
+            Transaction.objects.create(account=account, amount=Decimal('1.00'), type='credit', description="Seed")
+            Message.objects.create(user=user, sender='User', content="Hi")
+
+    def changelist_queries(self, url_name):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries_do_not_grow_per_row(self):
+        self.add_rows(2)
+        few = {name: self.changelist_queries(name) for name in (
+            'admin:accounts_transaction_changelist', 'admin:accounts_message_changelist',
+            'admin:accounts_bankaccount_changelist', 'admin:accounts_cardrequest_changelist',
+        )}
+        self.add_rows(8)
+        for name, count in few.items():
+            self.assertEqual(self.changelist_queries(name), count, name)
+
+    def test_estimated_count_only_for_unfiltered_large_tables(self):
+        self.add_rows(3)
+        with patch('accounts.pagination.estimated_row_count', return_value=5_000_000):
+            self.assertEqual(EstimatedCountPaginator(Transaction.objects.all(), 100).count, 5_000_000)
+            self.assertEqual(EstimatedCountPaginator(Transaction.objects.filter(type='credit'), 100).count, 3)
+        # SQLite has no planner estimate: exact count.
+        self.assertEqual(EstimatedCountPaginator(Transaction.objects.all(), 100).count, 3)
+
+    def test_user_autocomplete(self):
+        create_customer("zelda")
+        response = self.client.get(reverse('admin:autocomplete'), {
+            'term': 'zel', 'app_label': 'accounts', 'model_name': 'bankaccount', 'field_name': 'user',
+        })
+        self.assertEqual([r['text'] for r in response.json()['results']], ["zelda (zelda@example.com)"])
+
+
+class DashboardSnapshotTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user, self.account = create_customer("rosa", balance=100)
+        self.other_user, self.other = create_customer("sam", balance=100)
+        self.client.force_login(self.user)
+
+    def dashboard_queries(self):
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        # Session and auth user lookups come from middleware, not the dashboard.
+        return response, [q for q in queries if 'django_session' not in q['sql'] and 'FROM "accounts_user"' not in q['sql']]
+
+    def test_unchanged_dashboard_does_not_touch_the_database(self):
+        self.dashboard_queries()
+        response, queries = self.dashboard_queries()
+        self.assertEqual(queries, [])
+        self.assertEqual(response.context['account'].pk, self.account.pk)
+
+    def test_transfer_invalidates_both_parties(self):
+        self.dashboard_queries()
+        with self.captureOnCommitCallbacks(execute=True):
+            transfer(self.other, self.account, Decimal('25.00'), "Rent")
+        response, queries = self.dashboard_queries()
+        self.assertTrue(queries)
+        self.assertEqual(response.context['account'].balance, Decimal('125.00'))
+        self.assertEqual(response.context['transactions'][0].type, 'credit')
+
+    def test_deposit_message_and_card_request_invalidate(self):
+        writes = [
+            lambda: process_transaction(self.account, Decimal('5'), 'credit', 'Cash deposit'),
+            lambda: Message.objects.create(user=self.user, sender='Admin', content="Hello"),
+            lambda: CardRequest.objects.create(user=self.user),
+        ]
+        for write in writes:
+            self.dashboard_queries()
+            with self.captureOnCommitCallbacks(execute=True):
+                write()
+            _, queries = self.dashboard_queries()
+            self.assertTrue(queries)
+
+    def test_transactions_written_outside_the_engine_invalidate(self):
+        writes = [
+            lambda: Transaction.objects.create(account_id=self.account.pk, amount=5, type='credit', description="Admin fix"),
+            lambda: Transaction.objects.filter(account=self.account).get().delete(),
+            lambda: BankAccount.objects.get(pk=self.account.pk).save(),
+        ]
+        for write in writes:
+            self.dashboard_queries()
+            with self.captureOnCommitCallbacks(execute=True):
+                write()
+            _, queries = self.dashboard_queries()
+            self.assertTrue(queries)
+
+    def test_admin_bulk_action_invalidates(self):
+        self.dashboard_queries()
+        self.client.force_login(User.objects.create_superuser("staff", "staff@example.com", "pw"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('admin:accounts_bankaccount_changelist'), {
+                'action': 'freeze_bank_accounts', '_selected_action': [self.account.pk],
+            })
+        self.client.force_login(self.user)
+        response, _ = self.dashboard_queries()
+        self.assertEqual(response.context['account'].status, 'Frozen')
+
+
+class RequestAccountTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user, self.account = create_customer("tara", balance=50)
+
+    def test_user_and_account_load_in_one_query(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('transaction_history'))
+        self.assertEqual(response.context['account'].pk, self.account.pk)
+        account_queries = [q['sql'] for q in queries if 'accounts_bankaccount' in q['sql']]
+        self.assertEqual(len(account_queries), 1)
+        self.assertIn('JOIN "accounts_bankaccount"', account_queries[0])
+
+    def test_request_account_is_falsy_without_an_account(self):
+        self.client.force_login(User.objects.create_superuser("staff", "staff@example.com", "pw"))
+        self.assertEqual(self.client.get(reverse('transaction_history')).status_code, 404)
+
+    def test_sessions_from_model_backend_still_work(self):
+        self.client.force_login(self.user, backend='django.contrib.auth.backends.ModelBackend')
+        response = self.client.get(reverse('transaction_history'))
+        self.assertEqual(response.context['account'].pk, self.account.pk)
+
+
+class RecipientLookupTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        recipients.clear()
+        self.user, _ = create_customer("uma")
+        self.payee, self.payee_account = create_customer("victor")
+        self.client.force_login(self.user)
+
+    def lookup(self, number):
+        return self.client.get(reverse('get_recipient_name'), {'account_number': number})
+
+    def account_queries(self, number):
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            response = self.lookup(number)
+        # The auth middleware's user query reads FROM accounts_user; lookups read FROM accounts_bankaccount.
+        return response, [q for q in queries if 'FROM "accounts_bankaccount"' in q['sql']]
+
+    def test_one_query_per_distinct_number(self):
+        number = self.payee_account.account_number
+        response, queries = self.account_queries(number)
+        self.assertEqual(response.json()['name'], "Victor")
+        self.assertEqual(len(queries), 1)
+        _, queries = self.account_queries(number)
+        self.assertEqual(queries, [])
+        # Unknown numbers are cached as misses.
+        self.assertEqual(self.account_queries("000000000000")[0].json()['name'], '')
+        self.assertEqual(self.account_queries("000000000000")[1], [])
+
+    def test_partial_numbers_skip_lookup_and_limiter(self):
+        for _ in range(RATE_LIMIT + 5):
+            self.assertEqual(self.lookup("1234").json(), {'name': ''})
+        self.assertEqual(self.lookup(self.payee_account.account_number).status_code, 200)
+
+    def test_name_and_status_changes_invalidate(self):
+        number = self.payee_account.account_number
+        self.lookup(number)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.payee.first_name = "Vic"
+            self.payee.save()
+        self.assertEqual(self.lookup(number).json()['name'], "Vic")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.payee_account.status = 'Frozen'
+            self.payee_account.save()
+        self.assertEqual(self.lookup(number).json()['name'], '')
+        response = self.client.get(reverse('verify_account', args=[number]))
+        self.assertEqual(response.json(), {'success': True, 'name': "Vic User"})
+
+    def test_rate_limit_cuts_off_scraping(self):
+        # Pinned clock: the whole burst falls in one window.
+        with patch('accounts.lookup.time.time', return_value=1_000_000.0):
+            statuses = [self.lookup(f"{i:012d}").status_code for i in range(RATE_LIMIT + 3)]
+            self.assertEqual(self.client.get(reverse('verify_account', args=["999999999999"])).status_code, 429)
+        self.assertEqual(statuses.count(200), RATE_LIMIT)
+        self.assertEqual(statuses[-1], 429)
+
+    def test_rate_limit_holds_under_concurrency(self):
+        limiter = RateLimiter('concurrency-test', 5, 60)
+        with patch('accounts.lookup.time.time', return_value=1_000_000.0):
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                allowed = list(pool.map(lambda _: limiter.consume('k'), range(40)))
+        self.assertEqual(allowed.count(True), 5)
+
+    def test_lru_evicts_oldest(self):
+        lru = LRUCache(maxsize=2, ttl=60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertEqual(lru.get('a'), 1)
+        self.assertIsNot(lru.get('c'), None)
+        self.assertEqual(lru.get('b'), lookup_module._MISSING)
+
+
+class AccountNumberAllocatorTestCase(TestCase):
+    def setUp(self):
+        allocator.reset()
+
+    def test_luhn_check_digit(self):
+        self.assertEqual(luhn_check_digit("7992739871"), "3")
+        self.assertTrue(is_valid_account_number("100000000008"))
+        self.assertFalse(is_valid_account_number("100000000009"))
+        self.assertFalse(is_valid_account_number("12345"))
+
+    def test_accounts_get_valid_numbers_without_probes(self):
+        user, account = create_customer("first")
+        self.assertTrue(is_valid_account_number(account.account_number))
+        with CaptureQueriesContext(connection) as ctx:
+            _, second = create_customer("second")
+        # The block was claimed by the first account: no claim and no exists() probe now.
+        self.assertFalse([q for q in ctx.captured_queries if 'accountnumbersequence' in q['sql']])
+        self.assertFalse([q for q in ctx.captured_queries if 'LIMIT 1' in q['sql'] and 'account_number' in q['sql']])
+        self.assertEqual(int(second.account_number[:-1]), int(account.account_number[:-1]) + 1)
+
+    def test_one_claim_per_block(self):
+        with CaptureQueriesContext(connection) as ctx:
+            numbers = [allocator.allocate() for _ in range(BLOCK_SIZE + 1)]
+        self.assertEqual(len(set(numbers)), BLOCK_SIZE + 1)
+        self.assertEqual(len([q for q in ctx.captured_queries if 'accountnumbersequence' in q['sql']]), 2)
+
+    def test_skips_legacy_number_collision(self):
+        _, legacy = create_customer("legacy")
+        # An old random number that happens to be the allocator's next one.
+        next_number = with_check_digit(int(legacy.account_number[:-1]) + 1)
+        BankAccount.objects.filter(pk=legacy.pk).update(account_number=next_number)
+        _, account = create_customer("fresh")
+        self.assertNotEqual(account.account_number, next_number)
+        self.assertTrue(is_valid_account_number(account.account_number))
+
+    def test_generate_command_reserves_numbers(self):
+        out = StringIO()
+        call_command('generate_account_numbers', count=5, stdout=out)
+        numbers = out.getvalue().split()
+        self.assertEqual(len(set(numbers)), 5)
+        self.assertTrue(all(is_valid_account_number(n) for n in numbers))
+        _, account = create_customer("after")
+        self.assertNotIn(account.account_number, numbers)
+
+
+class ImportCustomersTestCase(TestCase):
+    FIELDS = ['username', 'email', 'password', 'first_name', 'last_name', 'phone_number', 'gender',
+              'street', 'zip_code', 'country', 'state', 'city', 'id_verification_number']
+
+    def row(self, username, **overrides):
+        row = {
+            'username': username, 'email': f"{username}@example.com", 'password': "importpass123",
+            'first_name': username.title(), 'last_name': "Imported", 'phone_number': "1234567890",
+            'gender': "Female", 'street': "1 Import Road", 'zip_code': "12345", 'country': "United Kingdom",
+            'state': "London", 'city': "London", 'id_verification_number': "ID-1",
+        }
+        row.update(overrides)
+        return row
+
+    def write(self, suffix, content):
+        f = tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False, newline='')
+        f.write(content)
+        f.close()
+        self.addCleanup(os.remove, f.name)
+        return f.name
+
+    def run_import(self, path, **options):
+        out, err = StringIO(), StringIO()
+        options.setdefault('workers', 1)
+        call_command('import_customers', path, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_csv_import_in_chunks_with_error_report(self):
+        create_customer("taken")
+        buffer = StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=self.FIELDS)
+        writer.writeheader()
+        writer.writerow(self.row("ann"))
+        writer.writerow(self.row("ben", country="Germany"))
+        writer.writerow(self.row("taken"))
+        writer.writerow(self.row("cal", email="not-an-email"))
+        writer.writerow(self.row("ann2", email="ann@example.com"))
+        writer.writerow(self.row("dee", id_verification_number=""))
+        path = self.write('.csv', buffer.getvalue())
+
+        with CaptureQueriesContext(connection) as ctx:
+            out, err = self.run_import(path, chunk_size=3)
+        self.assertIn("Imported 2 of 6 customers", out)
+        self.assertIn("3 rows: 2 imported, 1 failed", out)
+        self.assertEqual(len([q for q in ctx.captured_queries if q['sql'].startswith('INSERT INTO "accounts_user"')]), 1)
+
+        errors = {line: message for line, _, message in list(csv.reader(StringIO(err)))[1:]}
+        self.assertEqual(errors['4'], "Username already exists.")
+        self.assertIn("email:", errors['5'])
+        self.assertEqual(errors['6'], "Email already exists.")
+        self.assertIn("ID verification", errors['7'])
+
+        ben = BankAccount.objects.select_related('user').get(user__username="ben")
+        self.assertEqual(ben.currency_code, "EUR")
+        self.assertTrue(is_valid_account_number(ben.account_number))
+        self.assertTrue(ben.user.check_password("importpass123"))
+        self.assertTrue(self.client.login(username="ann", password="importpass123"))
+
+    def test_jsonl_with_hashing_pool(self):
+        lines = [json.dumps(self.row("eve")), "", "{not json", json.dumps(self.row("fay"))]
+        path = self.write('.jsonl', "\n".join(lines) + "\n")
+        report = path + '.errors.csv'
+        self.addCleanup(os.remove, report)
+
+        out, _ = self.run_import(path, workers=2, errors=report)
+        self.assertIn("Imported 2 of 3 customers", out)
+        with open(report) as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[1][0], '3')
+        self.assertTrue(User.objects.get(username="fay").check_password("importpass123"))
+        self.assertEqual(BankAccount.objects.get(user__username="eve").currency_code, "GBP")
+
+    def test_race_rejects_only_the_conflicting_row(self):
+        buffer = StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=self.FIELDS)
+        writer.writeheader()
+        for username in ("gus", "hal", "ivy"):
+            writer.writerow(self.row(username))
+        path = self.write('.csv', buffer.getvalue())
+
+        def register_meanwhile(passwords, pool=None):
+            # "hal" signs up after the uniqueness check, while the chunk is being hashed.
+            create_customer("hal")
+            return [make_password(password) for password in passwords]
+
+        with patch('accounts.imports.hash_passwords', register_meanwhile):
+            out, err = self.run_import(path)
+        self.assertIn("Imported 2 of 3 customers", out)
+        self.assertEqual(list(csv.reader(StringIO(err)))[1:], [['3', 'hal', "Username already exists."]])
+        self.assertEqual(BankAccount.objects.filter(user__username__in=["gus", "ivy"]).count(), 2)
+
+
+def image_upload(name, size, fmt='JPEG', orientation=None):
+    image = Image.new('RGB', size, 'teal')
+    exif = Image.Exif()
+    exif[0x010F] = "PhoneMaker"  # Make
+    if orientation:
+        exif[0x0112] = orientation
+    buffer = BytesIO()
+    image.save(buffer, fmt, exif=exif.tobytes())
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type=f"image/{fmt.lower()}")
+
+
+class PhotoThumbnailTestCase(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        settings_override = override_settings(MEDIA_ROOT=media)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user, _ = create_customer("snap")
+
+    def open_thumb(self, name):
+        with default_storage.open(name) as f:
+            image = Image.open(f)
+            image.load()
+        return image
+
+    def test_chat_photo_gets_stripped_downscaled_copies(self):
+        msg = Message.objects.create(user=self.user, photo=image_upload("big.jpg", (2400, 1800)))
+        thumbs = Message.objects.get(pk=msg.pk).photo_thumbnails
+        self.assertEqual(thumbs['source'], msg.photo.name)
+        self.assertEqual(sorted(thumbs['webp'], key=int), [str(w) for w in CHAT_WIDTHS])
+        webp = self.open_thumb(thumbs['webp']['640'])
+        jpeg = self.open_thumb(thumbs['jpeg']['160'])
+        self.assertEqual((webp.format, webp.size), ('WEBP', (640, 480)))
+        self.assertEqual((jpeg.format, jpeg.size), ('JPEG', (160, 120)))
+        self.assertFalse(webp.getexif())
+        self.assertFalse(jpeg.getexif())
+        self.assertLess(default_storage.size(thumbs['jpeg']['320']), msg.photo.size)
+
+    def test_small_photo_is_not_upscaled_and_orientation_applied(self):
+        msg = Message.objects.create(user=self.user, photo=image_upload("small.jpg", (200, 100), orientation=6))
+        self.assertEqual(list(msg.photo_thumbnails['jpeg']), ['100'])
+        self.assertEqual(self.open_thumb(msg.photo_thumbnails['jpeg']['100']).size, (100, 200))
+
+    def test_chat_page_and_sync_use_srcset(self):
+        msg = Message.objects.create(user=self.user, photo=image_upload("pic.png", (800, 600), fmt='PNG'))
+        self.client.login(username="snap", password="securepassword123")
+        page = self.client.get(reverse('user_messages')).content.decode()
+        self.assertIn('type="image/webp"', page)
+        self.assertIn(default_storage.url(msg.photo_thumbnails['webp']['640']) + ' 640w', page)
+        payload = self.client.get(reverse('sync_messages'), {'after': 0}).json()['messages'][0]
+        self.assertEqual(payload['photo_thumb'], default_storage.url(msg.photo_thumbnails['jpeg']['320']))
+        self.assertIn(' 160w', payload['photo_srcset']['webp'])
+
+    def test_replacing_profile_photo_rerenders_thumbnails(self):
+        self.user.photo = image_upload("me.jpg", (600, 600))
+        self.user.save()
+        old = self.user.photo_thumbnails['webp']['128']
+        self.user.photo = image_upload("me2.jpg", (600, 500))
+        self.user.save()
+        self.assertNotEqual(self.user.photo_thumbnails['webp']['128'], old)
+        # Old copies stay until the media GC runs (see ContentAddressedStorageTestCase).
+        self.assertTrue(default_storage.exists(old))
+        with CaptureQueriesContext(connection) as ctx:
+            self.user.save(update_fields=['last_login'])
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+    def test_backfill_command(self):
+        msg = Message.objects.create(user=self.user, photo=image_upload("old.jpg", (400, 300)))
+        Message.objects.filter(pk=msg.pk).update(photo_thumbnails={})
+        out = StringIO()
+        call_command('generate_thumbnails', model=['message'], stdout=out)
+        self.assertIn("Rendered thumbnails for 1 messages", out.getvalue())
+        self.assertEqual(list(Message.objects.get(pk=msg.pk).photo_thumbnails['jpeg']), ['160', '320', '400'])
+        out = StringIO()
+        call_command('generate_thumbnails', stdout=out)
+        self.assertIn("Rendered thumbnails for 0 messages", out.getvalue())
+
+
+class ContentAddressedStorageTestCase(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        settings_override = override_settings(MEDIA_ROOT=self.media)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user, _ = create_customer("dedupe")
+
+    def upload(self, name="screenshot.png"):
+        return image_upload(name, (300, 200), fmt='PNG')
+
+    def test_identical_uploads_share_one_file(self):
+        first = Message.objects.create(user=self.user, photo=self.upload("a.PNG"))
+        second = Message.objects.create(user=self.user, photo=self.upload("b.png"))
+        self.assertEqual(first.photo.name, second.photo.name)
+        self.assertTrue(is_content_addressed(first.photo.name))
+        self.assertTrue(first.photo.name.startswith("chat_photos/") and first.photo.name.endswith(".png"))
+        self.assertEqual(first.photo_thumbnails, second.photo_thumbnails)
+        self.assertEqual(len(os.listdir(os.path.dirname(content_store.path(first.photo.name)))), 1)
+        self.assertFalse([f for f in os.listdir(content_store.path("chat_photos")) if f.startswith('.')])
+
+    def test_reused_file_is_touched_against_gc(self):
+        first = Message.objects.create(user=self.user, photo=self.upload())
+        path = content_store.path(first.photo.name)
+        os.utime(path, (0, 0))
+        first.delete()
+        # The same bytes uploaded again before the orphan was collected.
+        content_store.save("chat_photos/again.png", self.upload())
+        self.assertGreater(os.path.getmtime(path), 0)
+        collect_garbage()
+        self.assertTrue(os.path.exists(path))
+
+    def test_gc_counts_references(self):
+        first = Message.objects.create(user=self.user, photo=self.upload())
+        second = Message.objects.create(user=self.user, photo=self.upload())
+        names = [first.photo.name, *first.photo_thumbnails['webp'].values()]
+        first.delete()
+
+        _, deleted, _ = collect_garbage(grace=timedelta(0))
+        self.assertEqual(deleted, [])
+        second.delete()
+        self.assertEqual(collect_garbage(grace=timedelta(hours=1))[1], [])
+
+        out = StringIO()
+        call_command('collect_media_garbage', grace_hours=0, stdout=out)
+        self.assertIn("Deleted 5 unreferenced files", out.getvalue())
+        self.assertFalse(any(content_store.exists(name) for name in names))
+
+    def test_gc_keeps_profile_photos_and_documents(self):
+        self.user.photo = self.upload()
+        self.user.id_verification_document = SimpleUploadedFile("id.pdf", b"%PDF-1.4 id")
+        self.user.save()
+        kept, deleted, _ = collect_garbage(grace=timedelta(0))
+        self.assertEqual(deleted, [])
+        self.assertEqual(kept, 2 + 2 * 2)
+
+
+class ProtectedMediaTestCase(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        settings_override = override_settings(MEDIA_ROOT=self.media)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.owner, _ = create_customer("owner")
+        self.other, _ = create_customer("other")
+        self.msg = Message.objects.create(user=self.owner, photo=image_upload("pic.jpg", (400, 300)))
+        self.owner.id_verification_document = SimpleUploadedFile("passport.pdf", b"%PDF-1.4 " + b"x" * 100)
+        self.owner.save()
+
+    def get(self, user, name, **headers):
+        self.client.force_login(user)
+        return self.client.get(content_store.url(name), headers=headers)
+
+    def test_owner_gets_file_streamed(self):
+        response = self.get(self.owner, self.msg.photo.name)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Cache-Control'], 'private, max-age=31536000, immutable')
+        with content_store.open(self.msg.photo.name) as f:
+            self.assertEqual(b''.join(response.streaming_content), f.read())
+
+    def test_other_customers_get_404(self):
+        thumb = self.msg.photo_thumbnails['webp']['160']
+        document = self.owner.id_verification_document.name
+        for name in (self.msg.photo.name, thumb, document):
+            self.assertEqual(self.get(self.other, name).status_code, 404)
+        self.assertEqual(self.get(self.owner, thumb).status_code, 200)
+        self.assertEqual(self.get(self.owner, document).status_code, 200)
+        self.other.is_staff = True
+        self.other.save()
+        self.assertEqual(self.get(self.other, document).status_code, 200)
+
+    def test_thumbnail_access_needs_an_exact_name(self):
+        thumb = self.msg.photo_thumbnails['webp']['160']
+        self.assertTrue(may_access(self.owner, thumb))
+        # Fragments of the owner's own thumbnail names are not files of theirs.
+        for name in ("thumbs/", thumb[:12], f"thumbs/{thumb[-10:]}", os.path.splitext(thumb)[0]):
+            self.assertFalse(may_access(self.owner, name))
+
+    def test_anonymous_and_traversal_rejected(self):
+        response = self.client.get(content_store.url(self.msg.photo.name))
+        self.assertEqual(response.status_code, 302)
+        self.client.force_login(self.owner)
+        self.assertEqual(self.client.get('/media/chat_photos/../../manage.py').status_code, 404)
+        self.assertEqual(self.get(self.owner, 'chat_photos/missing.jpg').status_code, 404)
+
+    def test_range_requests(self):
+        name = self.owner.id_verification_document.name
+        response = self.get(self.owner, name, Range='bytes=0-8')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 0-8/109')
+        self.assertEqual(response['Content-Length'], '9')
+        self.assertEqual(b''.join(response.streaming_content), b"%PDF-1.4 ")
+        response = self.get(self.owner, name, Range='bytes=-4')
+        self.assertEqual(b''.join(response.streaming_content), b"xxxx")
+        response = self.get(self.owner, name, Range='bytes=500-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */109')
+
+    async def test_asgi_fallback_reads_file_asynchronously(self):
+        await self.async_client.aforce_login(self.owner)
+        name = self.owner.id_verification_document.name
+        response = await self.async_client.get(content_store.url(name), headers={'Range': 'bytes=0-3'})
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response.is_async)
+        self.assertEqual(b"".join([chunk async for chunk in response.streaming_content]), b"%PDF")
+
+    def test_front_end_server_handoff(self):
+        name = self.msg.photo.name
+        with override_settings(MEDIA_ACCEL='nginx', MEDIA_ACCEL_PREFIX='/protected-media/'):
+            response = self.get(self.owner, name)
+        self.assertEqual(response['X-Accel-Redirect'], f"/protected-media/{name}")
+        self.assertEqual(response.content, b'')
+        with override_settings(MEDIA_ACCEL='sendfile'):
+            response = self.get(self.owner, name)
+        self.assertEqual(response['X-Sendfile'], os.path.join(self.media, name))
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
@@ -0,0 +1,122 @@
+import logging
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+
+logger = logging.getLogger(__name__)
+
+# Widths rendered for each photo field. The largest covers 2x screens at the
+# biggest size the templates show (64px avatar, 220px chat bubble).
+PROFILE_WIDTHS = (64, 128)
+CHAT_WIDTHS = (160, 320, 640)
+# Pillow save() options per derivative format. No exif= is passed, so EXIF
+# (GPS position, camera serial, ...) is dropped from every derivative.
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+THUMBNAIL_DIR = 'thumbs'
+
+
+def thumbnail_name(source, width, fmt):
+    stem = os.path.splitext(source)[0]
+    return f"{THUMBNAIL_DIR}/{stem}_{width}.{'jpg' if fmt == 'jpeg' else fmt}"
+
+
+def _load(field_file, max_width):
+    field_file.open('rb')
+    try:
+        image = Image.open(field_file)
+        # Let the JPEG decoder downscale by 1/2..1/8 while reading: much less
+        # work for a 12 MP phone photo that ends up 640px wide.
+        image.draft('RGB', (max_width, max_width))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    finally:
+        field_file.close()
+    return image
+
+
+def _encode(image, fmt):
+    pil_format, options = FORMATS[fmt]
+    if fmt == 'jpeg' and image.mode != 'RGB':
+        background = Image.new('RGB', image.size, 'white')
+        rgba = image.convert('RGBA')
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        image = background
+    elif image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+    buffer = BytesIO()
+    image.save(buffer, pil_format, **options)
+    return buffer.getvalue()
+
+
+def render_thumbnails(field_file, widths):
+    """
+    Write downscaled WebP and JPEG copies of an uploaded image (to the
+    field's storage, content-addressed like the original) and return
+    {'source': name, 'webp': {width: name}, 'jpeg': {width: name}} (widths as
+    strings, ready for a JSONField). Never upscales: widths above the
+    original's collapse into one copy at its own size. Returns {} if the file
+    is missing or not an image.
+    """
+    try:
+        image = _load(field_file, max(widths))
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError) as e:
+        logger.warning(f"Cannot make thumbnails for {field_file.name}: {e}")
+        return {}
+
+    thumbnails = {'source': field_file.name}
+    for fmt in FORMATS:
+        thumbnails[fmt] = {}
+    for width in sorted(set(min(width, image.width) for width in widths)):
+        resized = image if width == image.width else image.resize(
+            (width, max(1, round(image.height * width / image.width))), Image.LANCZOS
+        )
+        for fmt in FORMATS:
+            name = thumbnail_name(field_file.name, width, fmt)
+            thumbnails[fmt][str(width)] = field_file.storage.save(name, ContentFile(_encode(resized, fmt)))
+    return thumbnails
+
+
+def refresh_thumbnails(instance, widths, force=False):
+    """
+    Bring instance.photo_thumbnails in line with instance.photo. Writes with
+    queryset.update() so post_save handlers do not run again. Replaced
+    thumbnails are left for the media garbage collector, since identical
+    photos share them. Returns True if anything changed.
+    """
+    current = instance.photo_thumbnails or {}
+    if instance.photo:
+        if current.get('source') == instance.photo.name and not force:
+            return False
+        thumbnails = render_thumbnails(instance.photo, widths)
+    else:
+        if not current:
+            return False
+        thumbnails = {}
+    instance.photo_thumbnails = thumbnails
+    type(instance).objects.filter(pk=instance.pk).update(photo_thumbnails=thumbnails)
+    return True
+
+
+def srcset(photo, thumbnails, fmt):
+    """'url 160w, url 320w' for one derivative format, or '' if there are none."""
+    return ', '.join(
+        f"{photo.storage.url(name)} {width}w"
+        for width, name in sorted((thumbnails or {}).get(fmt, {}).items(), key=lambda item: int(item[0]))
+    )
+
+
+def thumbnail_url(photo, thumbnails, width):
+    """URL of the smallest JPEG at least `width` wide, falling back to the original upload."""
+    jpegs = sorted(((int(w), name) for w, name in (thumbnails or {}).get('jpeg', {}).items()))
+    if not jpegs:
+        return photo.url if photo else ''
+    for w, name in jpegs:
+        if w >= width:
+            return photo.storage.url(name)
+    return photo.storage.url(jpegs[-1][1])
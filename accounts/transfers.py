@@ -0,0 +1,332 @@
+import random
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction, OperationalError
+from django.db.models import F
+
+from .models import BalanceShard, BankAccount, Transaction
+from .summaries import record_activity
+from .sharding import collapse_shards, shard_credit
+from .snapshots import invalidate_dashboard
+
+
+# Retry settings for transient lock errors (deadlocks, serialization failures).
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 0.02  # seconds
+BACKOFF_CAP = 0.5  # seconds
+
+# Backend error messages that mean "try the whole transaction again".
+RETRYABLE_ERRORS = (
+    'deadlock detected',
+    'could not serialize access',
+    'lock wait timeout exceeded',
+    'deadlock found',
+    'database is locked',
+)
+
+
+def to_amount(value):
+    """
+    Normalise a user supplied amount to a 2dp Decimal.
+    Floats go through str() so 0.1 stays 0.1.
+    """
+    try:
+        amount = Decimal(str(value)).quantize(Decimal('0.01'))
+    except (InvalidOperation, ValueError, TypeError):
+        raise ValidationError("Invalid amount.")
+    if amount <= 0:
+        raise ValidationError("Amount must be positive.")
+    return amount
+
+
+def is_retryable(exc):
+    message = str(exc).lower()
+    return any(marker in message for marker in RETRYABLE_ERRORS)
+
+
+def run_with_retry(func, *args, **kwargs):
+    """
+    Run func(*args, **kwargs) in its own transaction, retrying on deadlock or
+    serialization errors with capped exponential backoff (full jitter).
+
+    When called inside an outer atomic block there is nothing safe to retry
+    (the outer transaction is already poisoned), so it runs exactly once.
+    """
+    if connection.in_atomic_block:
+        with transaction.atomic():
+            return func(*args, **kwargs)
+
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            with transaction.atomic():
+                return func(*args, **kwargs)
+        except OperationalError as exc:
+            if attempt == MAX_ATTEMPTS or not is_retryable(exc):
+                raise
+            delay = min(BACKOFF_CAP, BACKOFF_BASE * (2 ** (attempt - 1)))
+            time.sleep(random.uniform(0, delay))
+
+
+def lock_accounts(*pks):
+    """
+    SELECT ... FOR UPDATE the given accounts in primary key order.
+    Every writer takes its locks in the same order, so two transfers
+    in opposite directions queue instead of deadlocking. A sharded
+    account's shard rows are locked right after its own row, before any
+    higher account: the per-account order _transfer() follows, where a
+    credit takes a shard and a debit takes the row and then its shards.
+    Returns {pk: BankAccount}.
+    """
+    pks = sorted(set(pks))
+    sharded = set(BankAccount.objects.filter(pk__in=pks, balance_shards__gt=0).values_list('pk', flat=True))
+    locked = {}
+    run = []
+    for pk in pks:
+        run.append(pk)
+        if pk in sharded:
+            # Lock the accounts up to this one in one query, then its shards.
+            locked.update(_lock_rows(run))
+            run = []
+            shards = BalanceShard.objects.select_for_update().filter(account_id=pk).order_by('index')
+            list(shards.values_list('pk', flat=True))
+    if run:
+        locked.update(_lock_rows(run))
+    return locked
+
+
+def _lock_rows(pks):
+    accounts = BankAccount.objects.select_for_update().filter(pk__in=pks).order_by('pk')
+    return {account.pk: account for account in accounts}
+
+
+def credit(account_pk, amount, **conditions):
+    """
+    UPDATE bankaccount SET balance = balance + amount WHERE pk = ? [AND conditions].
+    Returns True if the row was updated.
+    """
+    updated = BankAccount.objects.filter(pk=account_pk, **conditions).update(balance=F('balance') + amount)
+    return updated == 1
+
+
+def debit(account_pk, amount, **conditions):
+    """
+    UPDATE bankaccount SET balance = balance - amount
+    WHERE pk = ? AND balance >= amount [AND conditions].
+    The funds check and the write are one statement, so there is no separate
+    locking SELECT. Returns False when the row did not qualify (usually
+    insufficient funds).
+    """
+    accounts = BankAccount.objects.filter(pk=account_pk, balance__gte=amount, **conditions)
+    if accounts.update(balance=F('balance') - amount):
+        return True
+
+    # A sharded account may hold the rest of its funds in shards: fold them
+    # into the main balance (under lock) and try once more.
+    if BankAccount.objects.filter(pk=account_pk, balance_shards__gt=0).exists() and collapse_shards(account_pk):
+        return accounts.update(balance=F('balance') - amount) == 1
+    return False
+
+
+def _credit_account(account, amount, count=1, **conditions):
+    """
+    Credit an account and its running totals. Sharded accounts take the credit
+    on a shard row, which also carries the totals until the next fold.
+    """
+    if account.balance_shards and shard_credit(account.pk, account.balance_shards, amount, count, **conditions):
+        return True
+    if credit(account.pk, amount, **conditions):
+        record_activity(account.pk, credit=amount, credits=count)
+        return True
+    return False
+
+
+def _debit_account(account, amount, count=1, **conditions):
+    if debit(account.pk, amount, **conditions):
+        record_activity(account.pk, debit=amount, debits=count)
+        return True
+    return False
+
+
+def _apply(account, amount, transaction_type, description, on_applied=None):
+    if transaction_type == 'credit':
+        applied = _credit_account(account, amount)
+    else:
+        applied = _debit_account(account, amount)
+    if not applied:
+        raise ValidationError("Insufficient funds.")
+
+    Transaction.objects.create(
+        account=account,
+        amount=amount,
+        type=transaction_type,
+        description=description
+    )
+    invalidate_dashboard(account.user_id)
+    if on_applied is not None:
+        on_applied()
+
+
+def apply_transaction(account, amount, transaction_type, description, on_applied=None):
+    """
+    Credit or debit a single account. See accounts.utils.process_transaction.
+    on_applied() runs in the same transaction after the balance changes (e.g.
+    to queue the confirmation email), so both commit or roll back together.
+    Returns the account with its balance re-read.
+    """
+    if transaction_type not in ['credit', 'debit']:
+        raise ValidationError("Invalid transaction type.")
+    run_with_retry(_apply, account, to_amount(amount), transaction_type, description, on_applied)
+    account.refresh_from_db(fields=['balance'])
+    return account
+
+
+def _refusal(sender_pk, receiver_pk):
+    """Work out why a transfer UPDATE matched no row. Only runs on the failure path."""
+    statuses = dict(BankAccount.objects.filter(pk__in=[sender_pk, receiver_pk]).values_list('pk', 'status'))
+    if statuses.get(sender_pk) != 'Active':
+        return "Your account is not active."
+    if statuses.get(receiver_pk) != 'Active':
+        return "Recipient’s account is not active."
+    return "Insufficient funds."
+
+
+def _transfer(sender, receiver, amount, description):
+    # Each UPDATE takes its row lock as it runs. Issue them in primary key
+    # order so transfers in opposite directions can't deadlock. Shard rows
+    # are locked within their account's step: shard_credit() takes one
+    # shard of the receiver (without its account row), and a debit that has
+    # to collapse_shards() locks the sender's account row and then its
+    # shards in index order. The order is therefore per account, by pk: an
+    # account's row, then its shards, then the next account. Every path
+    # must follow it, so lock_accounts() takes a sharded account's shards
+    # before moving on to higher accounts.
+    steps = sorted([
+        (sender.pk, lambda: _debit_account(sender, amount, status='Active')),
+        (receiver.pk, lambda: _credit_account(receiver, amount, status='Active')),
+    ], key=lambda step: step[0])
+    for _, move in steps:
+        if not move():
+            # Raising rolls back a credit that may already have been applied.
+            raise ValidationError(_refusal(sender.pk, receiver.pk))
+
+    invalidate_dashboard(sender.user_id, receiver.user_id)
+    return Transaction.objects.bulk_create([
+        Transaction(
+            account=sender,
+            amount=amount,
+            type='debit',
+            description=f'Transfer to {receiver.account_number} - {description}'
+        ),
+        Transaction(
+            account=receiver,
+            amount=amount,
+            type='credit',
+            description=f'Transfer from {sender.account_number} - {description}'
+        ),
+    ])
+
+
+def transfer(sender, receiver, amount, description):
+    """
+    Move amount from sender to receiver (BankAccount instances) atomically.
+    Raises ValidationError with a user facing message when the transfer is refused.
+    Returns the [debit, credit] Transaction rows.
+    """
+    if sender.pk == receiver.pk:
+        raise ValidationError("You cannot transfer to your own account.")
+    return run_with_retry(_transfer, sender, receiver, to_amount(amount), description)
+
+
+# Largest batch accepted by batch_transfer().
+MAX_BATCH_SIZE = 500
+
+
+def _batch_transfer(sender, items, all_or_nothing):
+    numbers = {str(item.get('account_number', '')).strip() for item in items}
+    receiver_pks = dict(BankAccount.objects.filter(account_number__in=numbers).values_list('account_number', 'pk'))
+    locked = lock_accounts(sender.pk, *receiver_pks.values())
+    sender_row = locked[sender.pk]
+    if sender_row.balance_shards:
+        sender_row.balance += collapse_shards(sender_row.pk)
+
+    available = sender_row.balance
+    credits = {}
+    credit_counts = {}
+    rows = []
+    results = []
+
+    for index, item in enumerate(items):
+        number = str(item.get('account_number', '')).strip()
+        result = {'index': index, 'account_number': number}
+        try:
+            amount = to_amount(item.get('amount'))
+            description = item.get('description') or 'Fund Transfer'
+            receiver = locked.get(receiver_pks.get(number))
+            if receiver is None:
+                raise ValidationError("Recipient account not found.")
+            if receiver.pk == sender_row.pk:
+                raise ValidationError("You cannot transfer to your own account.")
+            if sender_row.status != 'Active':
+                raise ValidationError("Your account is not active.")
+            if receiver.status != 'Active':
+                raise ValidationError("Recipient’s account is not active.")
+            if available < amount:
+                raise ValidationError("Insufficient funds.")
+        except ValidationError as e:
+            result.update(status='failed', error=e.messages[0])
+            results.append(result)
+            continue
+
+        available -= amount
+        credits[receiver.pk] = credits.get(receiver.pk, Decimal('0')) + amount
+        credit_counts[receiver.pk] = credit_counts.get(receiver.pk, 0) + 1
+        rows.append(Transaction(
+            account=sender_row,
+            amount=amount,
+            type='debit',
+            description=f'Transfer to {receiver.account_number} - {description}'
+        ))
+        rows.append(Transaction(
+            account=receiver,
+            amount=amount,
+            type='credit',
+            description=f'Transfer from {sender_row.account_number} - {description}'
+        ))
+        result.update(status='ok', amount=str(amount))
+        results.append(result)
+
+    failed = any(result['status'] == 'failed' for result in results)
+    if not rows or (all_or_nothing and failed):
+        # Nothing has been written yet, so there is nothing to undo.
+        for result in results:
+            if result['status'] == 'ok':
+                result['status'] = 'not_applied'
+        return results, 0
+
+    # All rows are already locked, so these UPDATEs can't fail or deadlock.
+    _debit_account(sender_row, sender_row.balance - available, count=len(rows) // 2)
+    for pk in sorted(credits):
+        _credit_account(locked[pk], credits[pk], count=credit_counts[pk])
+    Transaction.objects.bulk_create(rows)
+    invalidate_dashboard(sender_row.user_id, *(locked[pk].user_id for pk in credits))
+    return results, len(rows) // 2
+
+
+def batch_transfer(sender, items, all_or_nothing=False):
+    """
+    Settle many transfers from one sender in a single database transaction.
+    - sender: BankAccount instance (PIN already verified by the caller)
+    - items: list of {'account_number', 'amount', 'description'} dicts
+    - all_or_nothing: if True, any failed item cancels the whole batch
+    Every involved account is locked once, in primary key order, and all
+    Transaction rows go in with one bulk_create.
+    Returns (results, applied_count); results has one dict per item with
+    'status' set to 'ok', 'failed' (with 'error') or 'not_applied'.
+    """
+    if not items:
+        raise ValidationError("No transfers supplied.")
+    if len(items) > MAX_BATCH_SIZE:
+        raise ValidationError(f"A batch can contain at most {MAX_BATCH_SIZE} transfers.")
+    return run_with_retry(_batch_transfer, sender, items, all_or_nothing)
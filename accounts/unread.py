@@ -0,0 +1,86 @@
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Message, User
+
+
+# Cached counts expire so a lost invalidation can't stay wrong for long.
+CACHE_TIMEOUT = 60 * 60
+
+
+def _version_key(user_id):
+    return f"unread:version:{user_id}"
+
+
+def _version(user_id):
+    version = cache.get(_version_key(user_id))
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(_version_key(user_id), version, CACHE_TIMEOUT):
+            version = cache.get(_version_key(user_id), version)
+    return version
+
+
+def _invalidate(*user_ids):
+    """Move these users to a new cache version once the current transaction commits."""
+    transaction.on_commit(lambda: cache.set_many(
+        {_version_key(user_id): uuid.uuid4().hex for user_id in user_ids}, CACHE_TIMEOUT
+    ))
+
+
+def unread_count(user_id):
+    """
+    Unread admin replies for the badge. Normally two cache gets; on a miss
+    it reads User.unread_messages (a primary key lookup) and caches that.
+    The count is cached under the version read before the database, so a
+    count read before a writer commits is stored under a version the
+    writer has already replaced and is never served.
+    """
+    key = f"unread:{user_id}:{_version(user_id)}"
+    count = cache.get(key)
+    if count is None:
+        count = User.objects.filter(pk=user_id).values_list('unread_messages', flat=True).first() or 0
+        cache.add(key, count, CACHE_TIMEOUT)
+    return count
+
+
+def reply_added(user_id, count=1):
+    """
+    Count new unread admin replies. The Message post_save signal calls this;
+    bulk_create() skips signals, so bulk writers call it themselves.
+    """
+    User.objects.filter(pk=user_id).update(unread_messages=F('unread_messages') + count)
+    _invalidate(user_id)
+
+
+def replies_read(user_id, count=None):
+    """Mark count replies read, or all of them when count is None."""
+    if count is None:
+        User.objects.filter(pk=user_id).update(unread_messages=0)
+    else:
+        User.objects.filter(pk=user_id).update(unread_messages=Greatest(F('unread_messages') - count, Value(0)))
+    _invalidate(user_id)
+
+
+def rebuild_unread_counts(user_pks=None):
+    """
+    Recount User.unread_messages from the Message table in one UPDATE and drop
+    the cached values. Returns the number of users updated.
+    """
+    unread = (
+        Message.objects.filter(user=OuterRef('pk'), sender='Admin', is_read=False)
+        .order_by()
+        .values('user')
+        .annotate(total=Count('id'))
+        .values('total')
+    )
+    users = User.objects.all()
+    if user_pks is not None:
+        users = users.filter(pk__in=user_pks)
+    updated = users.update(unread_messages=Coalesce(Subquery(unread, output_field=IntegerField()), Value(0)))
+    _invalidate(*users.values_list('pk', flat=True))
+    return updated
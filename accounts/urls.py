@@ -8,15 +8,19 @@ urlpatterns = [
     path('logout/', views.logout_view, name='logout'),
     path('dashboard/', views.dashboard, name='dashboard'),
     path('transfer/', views.transfer_money, name='transfer_money'),
+    path('transfer/batch/', views.batch_transfer_money, name='batch_transfer_money'),
     path('verify-account/<str:account_number>/', views.verify_account, name='verify_account'),
     path('verify/<uuid:token>/', views.verify_email, name='verify_email'),
     path('messages/', views.user_messages, name='user_messages'),  # Chat messages  # Send message
     path('top-up/', views.top_up, name='top_up'),  # Top-up functionality
     path('deposit/', views.deposit, name='deposit'),  # Deposit functionality
     path('transaction-history/', views.transaction_history, name='transaction_history'),  # Transaction history
+    path('transaction-history/export/', views.export_statement, name='export_statement'),  # CSV / OFX statement
     path('privacy-policy/', views.privacy_policy, name='privacy_policy'),
     path('set-transaction-pin/', views.set_transaction_pin, name='set_transaction_pin'),  # Set transaction pin
     path('message/fetch/', views.fetch_messages, name='fetch_messages'),  # Fetch messages AJAX
+    path('messages/sync/', views.sync_messages, name='sync_messages'),  # Chat delta sync (id cursor)
+    path('messages/stream/', views.message_stream, name='message_stream'),  # SSE push (ASGI only)
     path('messages/unread_count/', views.unread_messages_count, name='unread_messages_count'),
     path('get-recipient-name/', views.get_recipient_name, name='get_recipient_name'),
     path('upload-photo/', views.upload_photo, name='upload_photo'),
@@ -6,7 +6,9 @@ from django.contrib import messages
 from django.core.mail import send_mail
 from django.db import transaction
 from django.core.paginator import Paginator
+import json
 import logging
+from functools import partial
 import os
 from django.core.mail import EmailMessage
 from django.template.loader import render_to_string
@@ -15,13 +17,26 @@ from django.urls import reverse
 from .forms import UserRegistrationForm, MessageForm, TransferForm, TransactionPinForm, ProfilePhotoForm
 from .models import BankAccount, Message, VerificationToken, Transaction, CardRequest, User, PaymentDetails
 from .utils import process_transaction, get_currency_from_country
+from .transfers import transfer, batch_transfer
+from .idempotency import idempotent
+from .pagination import keyset_page
+from .summaries import get_summary
+from .snapshots import dashboard_snapshot
+from .lookup import is_account_number, lookup_limiter, lookup_recipient
+from .exports import EXPORT_FORMATS
+from .outbox import queue_email
+from .unread import unread_count, replies_read
+from .events import message_payload, publish_unread, stream as message_events
+from .media import clean_media_name, may_access, media_response
 from django.core.exceptions import ValidationError
 from decimal import Decimal
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse
 from django.contrib.auth.hashers import make_password, check_password
-from django.db.models import Sum
 from django.utils import translation
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.utils import timezone
+from datetime import date, datetime, time, timedelta
 
 
 
@@ -31,6 +46,19 @@ from django.http import HttpResponse
 # Logger setup
 logger = logging.getLogger(__name__)
 
+# Rows per page on the transaction history page.
+HISTORY_PAGE_SIZE = 25
+
+# Most messages returned by one chat delta sync.
+SYNC_BATCH_SIZE = 100
+
+
+
+def account_or_404(request):
+    """request.account (see accounts.middleware), or 404 when the user has no account."""
+    if not request.account:
+        raise Http404("No bank account found.")
+    return request.account
 
 
 def index(request):
@@ -92,16 +120,9 @@ def send_verification_email(request, user):
             'user': user,
             'verification_link': verification_link,
         })
-        email = EmailMessage(
-            subject,
-            html_message,
-            settings.DEFAULT_FROM_EMAIL,
-            [user.email],
-        )
-        email.content_subtype = 'html'
-        email.send(fail_silently=False)
+        queue_email(subject, html_message, [user.email], settings.DEFAULT_FROM_EMAIL, html=True)
     except Exception as e:
-        logger.error(f"Failed to send email to {user.email}: {e}", exc_info=True)
+        logger.error(f"Failed to queue email to {user.email}: {e}", exc_info=True)
         raise e  # re-raise to be caught in register view
 
 
@@ -138,9 +159,8 @@ def login_view(request):
             login(request, user)
 
             # Check if bank account exists
-            try:
-                bank_account = BankAccount.objects.get(user=user)
-            except BankAccount.DoesNotExist:
+            bank_account = request.account
+            if not bank_account:
                 messages.error(request, "Bank account not found. Please contact support.")
                 return redirect('index')
 
@@ -165,17 +185,15 @@ def logout_view(request):
 
 @login_required
 def dashboard(request):
-    try:
-        account = BankAccount.objects.get(user=request.user)
-    except BankAccount.DoesNotExist:
+    account = request.account
+    if not account:
         messages.error(request, "Bank account not found. Please contact support.")
         return redirect('index')
 
-    # Fetch latest messages, transactions, card requests
-    messages_list = Message.objects.filter(user=request.user).order_by('-created_at')[:10]
-    transactions = Transaction.objects.filter(account=account).order_by('-date')[:10]
-    card_requests = CardRequest.objects.filter(user=request.user).order_by('-date_requested')
-    unread_messages = Message.objects.filter(user=request.user, sender='Admin', is_read=False).count()
+    # Latest messages, transactions and card requests, cached until one of
+    # them changes (see accounts.snapshots).
+    snapshot = dashboard_snapshot(request.user, account)
+    unread_messages = unread_count(request.user.pk)
 
     if request.method == 'POST':
         if 'withdraw' in request.POST:
@@ -215,17 +233,15 @@ def dashboard(request):
 
     return render(request, 'accounts/dashboard.html', {
         'account': account,
-        'chat_messages': messages_list,
-        'transactions': transactions,
-        'card_requests': card_requests,
+        **snapshot,
         'unread_messages': unread_messages,
     })
 
 
 @login_required
-@transaction.atomic
+@idempotent
 def transfer_money(request):
-    sender_account = get_object_or_404(BankAccount, user=request.user)
+    sender_account = account_or_404(request)
 
     if request.method == 'POST':
         form = TransferForm(request.POST)
@@ -251,51 +267,19 @@ def transfer_money(request):
 
             # ✅ 3. Validate recipient
             try:
-                receiver_account = BankAccount.objects.select_for_update().get(account_number=receiver_account_number)
+                receiver_account = BankAccount.objects.select_related('user').get(account_number=receiver_account_number)
             except BankAccount.DoesNotExist:
                 messages.error(request, "Recipient account not found.")
                 return redirect('transfer_money')
 
-            # Prevent self-transfer
-            if sender_account == receiver_account:
-                messages.error(request, "You cannot transfer to your own account.")
-                return redirect('transfer_money')
-
-            # Check both accounts' status
-            if sender_account.status != 'Active':
-                messages.error(request, "Your account is not active.")
-                return redirect('transfer_money')
-
-            if receiver_account.status != 'Active':
-                messages.error(request, "Recipient’s account is not active.")
-                return redirect('transfer_money')
-
-            # Check sufficient funds
-            if sender_account.balance < amount:
-                messages.error(request, "Insufficient funds.")
+            # ✅ 4. Perform transfer safely (ordered row locks, retried on deadlock)
+            # ✅ 5. Transactions for both accounts are recorded by the engine
+            try:
+                transfer(sender_account, receiver_account, amount, description)
+            except ValidationError as e:
+                messages.error(request, e.messages[0])
                 return redirect('transfer_money')
 
-            # ✅ 4. Perform transfer safely
-            with transaction.atomic():
-                sender_account.balance -= amount
-                receiver_account.balance += amount
-                sender_account.save()
-                receiver_account.save()
-
-                # ✅ 5. Record transactions for both accounts
-                Transaction.objects.create(
-                    account=sender_account,
-                    amount=amount,
-                    type='debit',
-                    description=f'Transfer to {receiver_account.account_number} - {description}'
-                )
-                Transaction.objects.create(
-                    account=receiver_account,
-                    amount=amount,
-                    type='credit',
-                    description=f'Transfer from {sender_account.account_number} - {description}'
-                )
-
             # # ✅ 6. Notify sender via email — made completely fail-safe
             # try:
             #     send_mail(
@@ -330,20 +314,74 @@ def transfer_money(request):
 
 
 @login_required
-def verify_account(request, account_number):
+@idempotent
+def batch_transfer_money(request):
+    """
+    JSON endpoint for payroll/merchant style bulk transfers.
+    POST body:
+        {"pin": "123456", "all_or_nothing": false,
+         "transfers": [{"account_number": "...", "amount": "10.00", "description": "..."}, ...]}
+    The PIN is checked once for the whole batch.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'POST required.'}, status=405)
+
+    try:
+        payload = json.loads(request.body or b'{}')
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid JSON.'}, status=400)
+
+    items = payload.get('transfers')
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        return JsonResponse({'success': False, 'error': 'transfers must be a list of objects.'}, status=400)
+
+    sender_account = account_or_404(request)
+    if sender_account.status == "Frozen":
+        return JsonResponse({'success': False, 'error': 'Your account is currently frozen. Transfers are disabled.'}, status=403)
+
+    entered_pin = str(payload.get('pin') or '')
+    if not entered_pin or not check_password(entered_pin, sender_account.transaction_pin):
+        return JsonResponse({'success': False, 'error': 'Incorrect transaction PIN.'}, status=403)
+
     try:
-        account = BankAccount.objects.get(account_number=account_number)
-        full_name = f"{account.user.first_name} {account.user.last_name}"
-        return JsonResponse({"success": True, "name": full_name})
-    except BankAccount.DoesNotExist:
-        return JsonResponse({"success":False})
+        results, applied = batch_transfer(sender_account, items, all_or_nothing=bool(payload.get('all_or_nothing')))
+    except ValidationError as e:
+        return JsonResponse({'success': False, 'error': e.messages[0]}, status=400)
+
+    logger.info(f"User {request.user.username} settled {applied}/{len(items)} batch transfers.")
+    return JsonResponse({
+        'success': applied == len(items),
+        'applied': applied,
+        'results': results,
+    })
+
+
+def _rate_limited(request):
+    """One recipient lookup from this user's token bucket; a 429 response when it is empty."""
+    if lookup_limiter.consume(request.user.pk):
+        return None
+    logger.warning(f"Recipient lookups throttled for {request.user.username}.")
+    return JsonResponse({'error': 'Too many lookups. Please wait a moment.'}, status=429)
+
+
+@login_required
+def verify_account(request, account_number):
+    if not is_account_number(account_number):
+        return JsonResponse({"success": False})
+    throttled = _rate_limited(request)
+    if throttled:
+        return throttled
+    recipient = lookup_recipient(account_number)
+    if recipient is None:
+        return JsonResponse({"success": False})
+    return JsonResponse({"success": True, "name": f"{recipient.first_name} {recipient.last_name}"})
 
 
 
 @login_required
 @transaction.atomic
 def set_transaction_pin(request):
-    account = get_object_or_404(BankAccount, user=request.user)
+    account = account_or_404(request)
 
     if request.method == "POST":
         pin = request.POST.get("pin")
@@ -393,7 +431,9 @@ def user_messages(request):
 
     # Mark all unread admin messages as read
     unread_admin_messages = messages_list.filter(sender='Admin', is_read=False)
-    unread_admin_messages.update(is_read=True)
+    if unread_admin_messages.update(is_read=True):
+        replies_read(request.user.pk)
+        publish_unread(request.user.pk, 0)
 
     if request.method == "POST":
         form = MessageForm(request.POST, request.FILES)
@@ -427,9 +467,13 @@ def fetch_messages(request):
     The frontend will hit this periodically (every few seconds).
     """
     last_msg_time = request.GET.get('last_time')
+    after_id = request.GET.get('after_id')
     user = request.user
 
-    if last_msg_time:
+    if after_id and after_id.isdigit():
+        # Id cursor: exact, index friendly, no timestamp parsing.
+        new_msgs = Message.objects.filter(user=user, id__gt=int(after_id)).order_by('id')
+    elif last_msg_time:
         new_msgs = Message.objects.filter(
             user=user,
             created_at__gt=last_msg_time
@@ -439,6 +483,7 @@ def fetch_messages(request):
 
     data = [
         {
+            'id': msg.id,
             'sender': msg.sender,
             'content': msg.content,
             'created_at': msg.created_at.strftime('%Y-%m-%d %H:%M:%S'),
@@ -449,23 +494,72 @@ def fetch_messages(request):
     return JsonResponse({'new_messages': data})
 
 
+@login_required
+def sync_messages(request):
+    """
+    Delta sync for the chat page: ?after=<last seen message id>.
+    Returns only newer messages as JSON. With nothing new this is one
+    indexed query returning no rows and no writes; admin replies are marked
+    read only when they are actually delivered.
+    """
+    after = request.GET.get('after', '0')
+    if not after.isdigit():
+        return JsonResponse({'error': 'after must be a message id.'}, status=400)
+
+    new_msgs = list(
+        Message.objects.filter(user=request.user, id__gt=int(after))
+        .order_by('id')
+        .only('id', 'sender', 'content', 'photo', 'photo_thumbnails', 'created_at', 'is_read')[:SYNC_BATCH_SIZE + 1]
+    )
+    more = len(new_msgs) > SYNC_BATCH_SIZE
+    new_msgs = new_msgs[:SYNC_BATCH_SIZE]
+
+    unread = [msg.id for msg in new_msgs if msg.sender == 'Admin' and not msg.is_read]
+    if unread:
+        replies_read(request.user.pk, Message.objects.filter(id__in=unread).update(is_read=True))
+        publish_unread(request.user.pk)
+
+    return JsonResponse({
+        'messages': [message_payload(msg) for msg in new_msgs],
+        'last_id': new_msgs[-1].id if new_msgs else int(after),
+        'more': more,
+    })
+
+
 @login_required
 def unread_messages_count(request):
     """
     Used to show notification badge (e.g. in navbar).
-    Returns count of unread admin messages.
+    Returns count of unread admin messages (a cache get, see accounts.unread).
     """
-    count = Message.objects.filter(
-        user=request.user,
-        sender='Admin',
-        is_read=False
-    ).count()
-    return JsonResponse({'unread_count':count})
+    return JsonResponse({'unread_count': unread_count(request.user.pk)})
+
 
 @login_required
-@transaction.atomic
+async def message_stream(request):
+    """
+    Server-Sent Events push channel for the chat page and the unread badge
+    (?after=<last seen message id>, or the Last-Event-ID header on reconnect).
+    Needs ASGI: under WSGI each open tab would hold a worker thread, so it
+    answers 204, which stops EventSource and the page keeps polling instead.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+
+    after = request.headers.get('Last-Event-ID') or request.GET.get('after', '0')
+    if not after.isdigit():
+        return JsonResponse({'error': 'after must be a message id.'}, status=400)
+
+    user = await request.auser()
+    response = StreamingHttpResponse(message_events(user.pk, int(after)), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # don't let nginx buffer the stream
+    return response
+
+@login_required
+@idempotent
 def top_up(request):
-    account = get_object_or_404(BankAccount, user=request.user)
+    account = account_or_404(request)
     payment = PaymentDetails.objects.filter(active=True).order_by("-updated_at").first()
 
     # Prevent top-up if account is frozen or inactive
@@ -482,19 +576,20 @@ def top_up(request):
                 return redirect('top_up')
 
             # Safely credit the account
-            process_transaction(account, amount, 'credit', 'Top-up from external source')
-
-            # Optional: send confirmation email (like in transfer)
-            send_mail(
-                subject="Top-Up Successful",
-                message=(
-                    f"Dear {request.user.first_name},\n\n"
-                    f"₦{amount:.2f} has been successfully added to your account.\n\n"
-                    "Thank you for banking with us.\n\nBest regards,\nSkyBank"
+            process_transaction(
+                account, amount, 'credit', 'Top-up from external source',
+                # Confirmation email: queued in the same transaction, sent by the outbox worker
+                on_applied=partial(
+                    queue_email,
+                    subject="Top-Up Successful",
+                    message=(
+                        f"Dear {request.user.first_name},\n\n"
+                        f"₦{amount:.2f} has been successfully added to your account.\n\n"
+                        "Thank you for banking with us.\n\nBest regards,\nSkyBank"
+                    ),
+                    from_email="skybank604@gmail.com",
+                    recipient_list=[request.user.email],
                 ),
-                from_email="skybank604@gmail.com",
-                recipient_list=[request.user.email],
-                fail_silently=True,
             )
 
             messages.success(request, f"{account.currency_symbol}{amount:.2f} has been added to your account.")
@@ -510,9 +605,9 @@ def top_up(request):
 
 
 @login_required
-@transaction.atomic
+@idempotent
 def deposit(request):
-    account = get_object_or_404(BankAccount, user=request.user)
+    account = account_or_404(request)
     payment = PaymentDetails.objects.filter(active=True).order_by("-updated_at").first()
 
     # Prevent deposit if account is frozen or inactive
@@ -529,19 +624,20 @@ def deposit(request):
                 return redirect('deposit')
 
             # Record transaction
-            process_transaction(account, amount, 'credit', 'Cash deposit')
-
-            # Optional: confirmation email
-            send_mail(
-                subject="Deposit Successful",
-                message=(
-                    f"Dear {request.user.first_name},\n\n"
-                    f"Your deposit of ₦{amount:.2f} has been successfully credited to your account.\n\n"
-                    "Thank you for banking with us.\n\nBest regards,\nSkyBank"
+            process_transaction(
+                account, amount, 'credit', 'Cash deposit',
+                # Confirmation email: queued in the same transaction, sent by the outbox worker
+                on_applied=partial(
+                    queue_email,
+                    subject="Deposit Successful",
+                    message=(
+                        f"Dear {request.user.first_name},\n\n"
+                        f"Your deposit of ₦{amount:.2f} has been successfully credited to your account.\n\n"
+                        "Thank you for banking with us.\n\nBest regards,\nSkyBank"
+                    ),
+                    from_email="skybank604@gmail.com",
+                    recipient_list=[request.user.email],
                 ),
-                from_email="skybank604@gmail.com",
-                recipient_list=[request.user.email],
-                fail_silently=True,
             )
 
             messages.success(request, f"{account.currency_symbol}{amount:.2f} deposited successfully.")
@@ -558,30 +654,75 @@ def deposit(request):
 
 @login_required
 def transaction_history(request):
-    account = get_object_or_404(BankAccount, user=request.user)
-    transactions = Transaction.objects.filter(account=account).order_by('-date')
-    total_credit = transactions.filter(type='credit').aggregate(Sum('amount'))['amount__sum'] or 0
-    total_debit = transactions.filter(type='debit').aggregate(Sum('amount'))['amount__sum'] or 0
+    account = account_or_404(request)
+    history = Transaction.objects.filter(account=account)
+    # Running totals kept up to date by the transfer engine (no ledger scan).
+    summary = get_summary(account)
+
+    # Keyset pagination: ?before=<cursor> costs the same at any depth.
+    cursor = request.GET.get('before')
+    transactions, next_cursor = keyset_page(history, cursor, HISTORY_PAGE_SIZE)
 
     return render(request, 'accounts/transaction_history.html', {
         'transactions': transactions,
         'account': account,
-        'total_credit': total_credit,
-        'total_debit': total_debit,
+        'total_credit': summary.total_credit,
+        'total_debit': summary.total_debit,
+        'summary': summary,
+        'next_cursor': next_cursor,
+        'is_first_page': not cursor,
 })
 
 
 
+@login_required
+def export_statement(request):
+    """
+    Stream the account statement as CSV or OFX.
+    ?format=csv|ofx&start=YYYY-MM-DD&end=YYYY-MM-DD (end is inclusive).
+    Rows are read in chunks and written straight to the client, so memory
+    stays flat and the first bytes go out before the query has finished.
+    """
+    account = account_or_404(request)
+
+    export_format = request.GET.get('format', 'csv').lower()
+    if export_format not in EXPORT_FORMATS:
+        return HttpResponse("Unsupported export format.", status=400)
+
+    try:
+        start_date = date.fromisoformat(request.GET['start']) if request.GET.get('start') else account.created_at.date()
+        end_date = date.fromisoformat(request.GET['end']) if request.GET.get('end') else timezone.localdate()
+    except ValueError:
+        return HttpResponse("Dates must be in YYYY-MM-DD format.", status=400)
+    if end_date < start_date:
+        return HttpResponse("End date is before start date.", status=400)
+
+    start = timezone.make_aware(datetime.combine(start_date, time.min))
+    end = timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min))
+
+    stream, astream, content_type = EXPORT_FORMATS[export_format]
+    if isinstance(request, ASGIRequest):
+        stream = astream
+    response = StreamingHttpResponse(stream(account, start, end), content_type=content_type)
+    filename = f"statement_{account.account_number}_{start_date:%Y%m%d}_{end_date:%Y%m%d}.{export_format}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    logger.info(f"User {request.user.username} exported {export_format} statement {start_date} to {end_date}.")
+    return response
+
+
 @login_required
 def get_recipient_name(request):
     account_number = request.GET.get('account_number', '').strip()
-    if account_number:
-        try:
-            account = BankAccount.objects.get(account_number=account_number, status='Active')
-            return JsonResponse({'name': account.user.first_name})
-        except BankAccount.DoesNotExist:
-            return JsonResponse({'name': ''})
-    return JsonResponse({'name': ''})
+    # Partial numbers (typing in progress) are answered without a lookup.
+    if not is_account_number(account_number):
+        return JsonResponse({'name': ''})
+    throttled = _rate_limited(request)
+    if throttled:
+        return throttled
+    recipient = lookup_recipient(account_number)
+    if recipient is None or recipient.status != 'Active':
+        return JsonResponse({'name': ''})
+    return JsonResponse({'name': recipient.first_name})
 
 
 @login_required
@@ -602,6 +743,22 @@ def upload_photo(request):
     return redirect('dashboard')
 
 
+@login_required
+def protected_media(request, path):
+    """
+    Every /media/ URL: only the owner (or staff) gets the file, handed off to
+    the front-end server when MEDIA_ACCEL is set. 404 rather than 403 so
+    other users' file names cannot be probed.
+    """
+    name = clean_media_name(path)
+    if name is None or not may_access(request.user, name):
+        raise Http404
+    response = media_response(request, name)
+    if response is None:
+        raise Http404
+    return response
+
+
 def privacy_policy(request):
     return render(request, 'accounts/privacy_policy.html')
 
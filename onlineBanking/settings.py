@@ -59,6 +59,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'accounts.middleware.account_middleware',  # lazy request.account
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 
@@ -112,6 +113,17 @@ else:  # Development environment
         }
     }
 
+# Shared cache for counters and snapshots. The default is per process; point
+# CACHE_BACKEND/CACHE_LOCATION at Redis (django.core.cache.backends.redis.RedisCache)
+# when running more than one web process. With LocMemCache each worker keeps
+# its own counters, so rate limits (accounts.lookup) apply per process.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default=''),
+    }
+}
+
 
 
 # Password validation
@@ -171,6 +183,12 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')  # ← ALWAYS set this
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Media is served by accounts.views.protected_media after an ownership check.
+# 'nginx' hands the transfer off with X-Accel-Redirect to MEDIA_ACCEL_PREFIX
+# (an `internal` location aliased to MEDIA_ROOT); 'sendfile' uses X-Sendfile
+# (Apache mod_xsendfile, lighttpd). Empty streams the file from Django.
+MEDIA_ACCEL = config('MEDIA_ACCEL', default='')
+MEDIA_ACCEL_PREFIX = config('MEDIA_ACCEL_PREFIX', default='/protected-media/')
 
 if DEBUG:
     # Development: serve directly from assets folder
@@ -190,6 +208,13 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'accounts.User'
 
+# AccountBackend joins the BankAccount into the per-request user query.
+# ModelBackend stays listed so sessions created before it keep working.
+AUTHENTICATION_BACKENDS = [
+    'accounts.backends.AccountBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
 
 LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/dashboard/'   # after login
@@ -240,6 +265,13 @@ LOGGING = {
 
 APPEND_SLASH = True
 
+# How long a stored response for an Idempotency-Key is replayed (seconds).
+# Expired keys are removed by `manage.py purge_idempotency_keys`.
+IDEMPOTENCY_KEY_TTL = config('IDEMPOTENCY_KEY_TTL', default=60 * 60 * 24, cast=int)
+# An unanswered claim older than this (seconds) is treated as abandoned by a
+# crashed worker, and a retry with the same key may take it over.
+IDEMPOTENCY_CLAIM_LEASE = config('IDEMPOTENCY_CLAIM_LEASE', default=60, cast=int)
+
 LOCALE_PATHS = [
     os.path.join(BASE_DIR, 'locale'),
 ]
@@ -14,13 +14,18 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
+from accounts.views import protected_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    # Uploads go through an ownership check in every environment (see MEDIA_ACCEL).
+    re_path(r'^%s(?P<path>.+)$' % re.escape(settings.MEDIA_URL.lstrip('/')), protected_media, name='protected_media'),
     path('i18n/', include('django.conf.urls.i18n')),
     path('', include('accounts.urls')),
 ]
@@ -29,7 +34,3 @@ urlpatterns = [
 if settings.DEBUG and hasattr(settings, 'STATICFILES_DIRS'):
     for static_dir in settings.STATICFILES_DIRS:
         urlpatterns += static(settings.STATIC_URL, document_root=static_dir)
-
-# Always serve media files when DEBUG is on (independent of STATICFILES_DIRS)
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file